@@ -1,14 +1,89 @@
 import streamlit as st
 import pandas as pd
-from utils.data_loader import BigQueryDataLoader
-from utils.data_cleaner import DataCleaner
+from utils.data_loader import BigQueryDataLoader, DataLoadError
+from utils.data_cleaner import DataCleaner, ensure_datetime
 from utils.persona_generator import PersonaGenerator
-from utils.persona_marketing_stats import compute_marketing_stats
+from utils.persona_marketing_stats import compute_all_marketing_stats
 from utils.consumer_type_analyzer import ConsumerTypeAnalyzer
-from utils.visualisations import create_prescriptive_map, create_seasonal_trends_chart
-from streamlit_folium import st_folium
+from utils.visualisations import render_prescriptive_map_html, create_seasonal_trends_chart
+import streamlit.components.v1 as components
 import traceback
 
+# Copy-on-write lets derived frames share unchanged columns instead of copying them, so the
+# cleaning, persona and stats steps make fewer full copies. It is a global pandas option,
+# so each entry script sets it
+pd.set_option('mode.copy_on_write', True)
+
+# --- Data Pipeline ---
+@st.cache_resource # One loader per process, so credentials and the connection test run only once
+def _cached_loader() -> BigQueryDataLoader:
+    return BigQueryDataLoader()
+
+def get_loader() -> BigQueryDataLoader:
+    """
+    Returns the shared loader. A loader whose BigQuery connection failed is still
+    returned, but dropped from the cache so the next call connects again.
+    """
+    loader = _cached_loader()
+    if loader.client is None:
+        # Don't let one transient failure pin the process to demo data
+        _cached_loader.clear()
+    return loader
+
+@st.cache_data(ttl=3600, show_spinner=False) # Cache per (method, limit, source, use_minibatch, backend) so switching back is instant
+def build_dataset(method: str, limit: int = 50000, source: str = "bigquery", use_minibatch: bool = False, backend: str = "sklearn", _loader: BigQueryDataLoader = None):
+    """
+    Loads, cleans and personafies the bike data for the given persona method.
+    source is "bigquery" or "demo". A "bigquery" build raises DataLoadError instead
+    of falling back, so demo data is never cached under the BigQuery key. A "demo"
+    build never queries BigQuery, so it can't cache real rows under the demo key.
+    use_minibatch and backend only affect K-Means builds. _loader is not hashed into the cache key.
+    Returns None when the loaded data is empty.
+    """
+    data_loader = _loader or get_loader()
+    if source == "demo":
+        df = data_loader.load_demo_data(limit=limit)
+    else:
+        df = data_loader.load_bike_data(limit=limit, demo_fallback=False)
+    if df is None or df.empty:
+        return None
+
+    df = DataCleaner.clean_bike_data(df)
+
+    # Conditional Persona Generation based on sidebar selection
+    if method == "Rule-Based (Simple)":
+        df = PersonaGenerator.add_persona_column(df)
+    else: # K-Means Clustering
+        # The loader normally returns these columns already; only derive them when missing
+        if 'start_date' in df.columns and not {'hour', 'is_weekend', 'is_weekday'}.issubset(df.columns):
+            # BigQuery returns TIMESTAMP columns as datetime64 already, so this normally parses nothing
+            df = ensure_datetime(df)
+            start_datetime = df['start_date']
+            weekday = start_datetime.dt.weekday
+            df['hour'] = start_datetime.dt.hour.astype('int8')
+            df['is_weekend'] = (weekday >= 5).astype('int8')
+            df['is_weekday'] = 1 - df['is_weekend']
+        if 'duration_minutes' not in df.columns and 'duration' in df.columns:
+            df['duration_minutes'] = df['duration'] / 60
+        df = PersonaGenerator.add_persona_column(df, use_clustering=True, use_minibatch=use_minibatch, backend=backend)
+
+    return df
+
+def load_dataset(method: str, limit: int = 50000, use_minibatch: bool = False, backend: str = "sklearn"):
+    """
+    Returns the personafied dataset, from BigQuery when the loader is connected and the
+    query succeeds, otherwise from the demo data (cached under its own key).
+    """
+    loader = get_loader()
+    if loader.client is None:
+        st.warning("BigQuery is not available. Showing demo data instead.")
+    else:
+        try:
+            return build_dataset(method, limit, "bigquery", use_minibatch, backend, _loader=loader)
+        except DataLoadError as e:
+            st.warning(f"{e}. Showing demo data instead.")
+    return build_dataset(method, limit, "demo", use_minibatch, backend, _loader=loader)
+
 # --- Page Configuration ---
 st.set_page_config(page_title="Persona Marketing Stats", layout="wide")
 
@@ -22,6 +97,25 @@ persona_method = st.sidebar.radio(
     - **K-Means Clustering:** Uses machine learning to find natural groups in the data.
     """
 )
+use_minibatch = False
+clustering_backend = "sklearn"
+if persona_method == "K-Means Clustering (Advanced)":
+    use_minibatch = st.sidebar.checkbox(
+        "Fast approximate clustering",
+        help="""
+        Clusters large datasets with MiniBatchKMeans, which is much faster. Its cluster
+        numbers can differ from full K-Means, so the persona names may not match the
+        groups they were derived from.
+        """
+    )
+    if st.sidebar.checkbox(
+        "Cluster on the GPU when available",
+        help="""
+        Uses cuML's K-Means when it is installed, otherwise scikit-learn. cuML numbers
+        clusters differently, so the persona labels can differ from scikit-learn's.
+        """
+    ):
+        clustering_backend = "auto"
 
 # --- Main Page Content ---
 st.title("💡 Prescriptive Marketing Insights for Bike Data")
@@ -35,6 +129,10 @@ if 'df' not in st.session_state:
     st.session_state.df = None
 if 'last_method' not in st.session_state:
     st.session_state.last_method = None
+if 'persona_options' not in st.session_state:
+    st.session_state.persona_options = ["ALL"]
+if 'marketing_stats' not in st.session_state:
+    st.session_state.marketing_stats = {}
 
 # --- Data Loading and Processing ---
 # Invalidate data if the method changes, prompting the user to reload
@@ -45,27 +143,17 @@ if st.session_state.last_method != persona_method:
 if st.button("Load Data and Generate Insights", type="primary"):
     with st.spinner(f"Connecting to BigQuery, cleaning data, and generating personas using **{persona_method}**..."):
         try:
-            data_loader = BigQueryDataLoader()
-            df = data_loader.load_bike_data(limit=50000)
-            if df is None or df.empty:
+            df = load_dataset(persona_method, limit=50000, use_minibatch=use_minibatch, backend=clustering_backend)
+            if df is None:
                 st.error("Loaded data is empty. Please check your data source or credentials.")
                 st.session_state.df = None
             else:
-                df = DataCleaner.clean_bike_data(df)
-
-                # Conditional Persona Generation based on sidebar selection
-                if persona_method == "Rule-Based (Simple)":
-                    df = PersonaGenerator.add_persona_column(df)
-                else: # K-Means Clustering
-                    if 'start_date' in df.columns:
-                        df['hour'] = pd.to_datetime(df['start_date']).dt.hour
-                        df['is_weekend'] = (pd.to_datetime(df['start_date']).dt.weekday >= 5).astype(int)
-                        df['is_weekday'] = (pd.to_datetime(df['start_date']).dt.weekday < 5).astype(int)
-                    if 'duration_minutes' not in df.columns and 'duration' in df.columns:
-                        df['duration_minutes'] = df['duration'] / 60
-                    df = PersonaGenerator.add_persona_column(df, use_clustering=True)
-
                 st.session_state.df = df
+                # Stats for every persona only change when new data is loaded, so compute them
+                # all once here instead of on every rerun
+                marketing_stats = compute_all_marketing_stats(df)
+                st.session_state.marketing_stats = marketing_stats
+                st.session_state.persona_options = ["ALL"] + sorted(p for p in marketing_stats if p != "ALL")
                 st.session_state.last_method = persona_method
                 st.success(f"Successfully loaded data and generated insights using {persona_method}!")
         except Exception as e:
@@ -74,19 +162,13 @@ if st.button("Load Data and Generate Insights", type="primary"):
 
 # --- Main Display Logic ---
 if st.session_state.df is not None:
-    df_for_analysis = st.session_state.df
-
-    persona_options = ["ALL"]
-    if "persona" in df_for_analysis.columns:
-        persona_options += sorted(df_for_analysis["persona"].dropna().unique())
-    
     selected_persona = st.selectbox(
         "**Select a Persona to Analyze**",
-        persona_options,
+        st.session_state.persona_options,
         help="Choose a persona to see specific statistics and recommendations."
     )
 
-    stats = compute_marketing_stats(df_for_analysis, selected_persona)
+    stats = st.session_state.marketing_stats[selected_persona]
     
     if "error" in stats:
         st.warning(stats["error"])
@@ -98,14 +180,15 @@ if st.session_state.df is not None:
         st.subheader("✅ Actionable Recommendations Map")
         st.info("This map shows the most valuable places to advertise for the selected persona. Use the layer control in the top right to toggle views.")
 
-        # Create and display the prescriptive map with all required data
-        prescriptive_map = create_prescriptive_map(
+        # Create and display the prescriptive map with all required data; the rendered HTML is
+        # cached per persona and embedded as-is, so map interactions don't trigger reruns
+        prescriptive_map_html = render_prescriptive_map_html(
             corridors_data=stats.get("top_travel_corridors_with_coords"),
             top_start_stations_data=stats.get("top_start_stations_with_coords"),
             top_end_stations_data=stats.get("top_end_stations_with_coords"),
             persona_stations_data=stats.get("persona_stations_with_coords")
         )
-        st_folium(prescriptive_map, width='100%', height=500)
+        components.html(prescriptive_map_html, height=500)
 
         with st.expander("Reveal Insights Data"):
             prescriptive_col1, prescriptive_col2 = st.columns(2)
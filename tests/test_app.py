@@ -0,0 +1,16 @@
+from unittest import mock
+
+import app
+from utils.data_loader import BigQueryDataLoader
+
+
+def test_demo_build_does_not_query_bigquery():
+    loader = BigQueryDataLoader.__new__(BigQueryDataLoader)
+    loader.client = mock.Mock()
+    loader.bqstorage_client = mock.Mock()
+    app.build_dataset.clear()
+
+    df = app.build_dataset("Rule-Based (Simple)", 1000, "demo", _loader=loader)
+
+    assert df is not None and 0 < len(df) <= 1000
+    loader.client.query.assert_not_called()
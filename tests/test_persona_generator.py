@@ -0,0 +1,72 @@
+import importlib.machinery
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+
+from utils import persona_generator
+from utils.persona_generator import PersonaGenerator
+
+
+def test_unparseable_start_date_is_general_user():
+    df = pd.DataFrame({
+        'start_date': ['2022-03-01 08:15:00', 'not a date'],
+        'duration_minutes': [12.0, 12.0],
+    })
+
+    personas = PersonaGenerator.assign_persona_rule_based_vectorized(df)
+
+    assert personas.tolist() == ['Morning Commuter', 'General User']
+    assert PersonaGenerator.assign_persona_rule_based(df.iloc[1]) == 'General User'
+
+
+def _trips(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'start_date': pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.integers(0, 365 * 24, n), unit='h'),
+        'duration_minutes': rng.uniform(1, 120, n),
+    })
+
+
+def test_add_persona_column_can_cluster_with_minibatch(monkeypatch):
+    fitted = []
+
+    class SpyMiniBatchKMeans(MiniBatchKMeans):
+        def fit_predict(self, X, y=None, sample_weight=None):
+            fitted.append(len(X))
+            return super().fit_predict(X, y, sample_weight)
+
+    monkeypatch.setattr(persona_generator, 'MiniBatchKMeans', SpyMiniBatchKMeans)
+    monkeypatch.setattr(PersonaGenerator, 'MINIBATCH_MIN_ROWS', 0)
+
+    result = PersonaGenerator.add_persona_column(_trips(500), use_minibatch=True)
+
+    assert fitted == [500]
+    assert result['persona'].notna().all()
+
+
+def test_add_persona_column_can_cluster_with_cuml(monkeypatch):
+    fitted = []
+
+    class FakeCumlKMeans:
+        def __init__(self, n_clusters, random_state, output_type):
+            self.n_clusters = n_clusters
+
+        def fit_predict(self, X):
+            fitted.append(X.dtype)
+            return np.arange(len(X)) % self.n_clusters
+
+    cuml = types.ModuleType('cuml')
+    cuml.__spec__ = importlib.machinery.ModuleSpec('cuml', None)
+    cuml_cluster = types.ModuleType('cuml.cluster')
+    cuml_cluster.KMeans = FakeCumlKMeans
+    cuml.cluster = cuml_cluster
+    monkeypatch.setitem(sys.modules, 'cuml', cuml)
+    monkeypatch.setitem(sys.modules, 'cuml.cluster', cuml_cluster)
+
+    result = PersonaGenerator.add_persona_column(_trips(10), backend='cuml')
+
+    assert fitted == [np.float32]
+    assert result['cluster'].tolist() == [i % 5 for i in range(10)]
@@ -4,6 +4,10 @@ from utils.data_loader import BigQueryDataLoader
 from utils.data_cleaner import DataCleaner
 from utils.persona_generator import PersonaGenerator
 
+# Same setting as app.py: this page runs the same cleaning and persona steps, which make
+# fewer full copies with copy-on-write on
+pd.set_option('mode.copy_on_write', True)
+
 st.set_page_config(page_title="Persona Filter", layout="centered")
 st.title("🚴‍♂️ Persona Filter for Bike Data")
 
@@ -11,6 +15,10 @@ st.write("Click the button below to pull the first rows from the London bicycle
 
 if 'df' not in st.session_state:
     st.session_state.df = None
+if 'persona_options' not in st.session_state:
+    st.session_state.persona_options = ["ALL"]
+if 'persona_index' not in st.session_state:
+    st.session_state.persona_index = {}
 
 if st.button("Pull Data and Add Persona", type="primary"):
     with st.spinner("Connecting to BigQuery and loading data..."):
@@ -24,6 +32,10 @@ if st.button("Pull Data and Add Persona", type="primary"):
                 df = DataCleaner.clean_bike_data(df)
                 df = PersonaGenerator.add_persona_column(df)
                 st.session_state.df = df
+                # Persona row positions and the persona list only change when new data is loaded,
+                # so compute them once here
+                st.session_state.persona_index = df.groupby("persona", observed=True, sort=False).indices
+                st.session_state.persona_options = ["ALL"] + sorted(st.session_state.persona_index)
                 st.success("Successfully loaded data and added persona column!")
         except Exception as e:
             st.error(f"Error loading data from BigQuery: {e}")
@@ -31,12 +43,10 @@ if st.button("Pull Data and Add Persona", type="primary"):
             st.code(traceback.format_exc(), language="python")
 
 if st.session_state.df is not None:
-    persona_options = ["ALL"]
-    if "persona" in st.session_state.df.columns:
-        persona_options += sorted(st.session_state.df["persona"].dropna().unique())
-    selected_persona = st.selectbox("Select Persona to Filter", persona_options)
+    df = st.session_state.df
+    selected_persona = st.selectbox("Select Persona to Filter", st.session_state.persona_options)
     if selected_persona == "ALL":
-        filtered_df = st.session_state.df
+        filtered_df = df
     else:
-        filtered_df = st.session_state.df[st.session_state.df["persona"] == selected_persona]
+        filtered_df = df.take(st.session_state.persona_index[selected_persona])
     st.dataframe(filtered_df.head(20)) 
\ No newline at end of file
@@ -1,5 +1,10 @@
+import functools
 import pandas as pd
-from typing import Dict, Any, List
+from types import MappingProxyType
+from typing import Dict, Any, Tuple
+
+# Returned for the "ALL" persona
+_ALL_BRANDS = ("Multi-segment brands", "Universal platforms", "Community-focused brands")
 
 class ConsumerTypeAnalyzer:
     """
@@ -7,31 +12,32 @@ class ConsumerTypeAnalyzer:
     """
     
     # Brand recommendations for each persona
-    PERSONA_BRANDS = {
-        "Morning Commuter": [
+    PERSONA_BRANDS = MappingProxyType({
+        "Morning Commuter": (
             "Starbucks", "Dunkin'", "Fitbit", "Apple Watch", "Nike", "Under Armour",
             "Transit apps", "Premium coffee brands", "Fitness trackers"
-        ],
-        "Evening Commuter": [
+        ),
+        "Evening Commuter": (
             "Uber Eats", "DoorDash", "Netflix", "Spotify", "Social media platforms",
             "Restaurant chains", "Entertainment apps"
-        ],
-        "Weekend Explorer": [
+        ),
+        "Weekend Explorer": (
             "Instagram", "TikTok", "Airbnb", "Eventbrite", "Local breweries",
             "Adventure gear brands", "Tourist attractions", "Social platforms"
-        ],
-        "Fitness": [
+        ),
+        "Fitness": (
             "Peloton", "MyFitnessPal", "Garmin", "Lululemon", "CrossFit",
             "Protein brands", "Gym chains", "Fitness apps"
-        ],
-        "Tourist/Long Leisure": [
+        ),
+        "Tourist/Long Leisure": (
             "TripAdvisor", "Booking.com", "Museums", "Cultural institutions",
             "Tourism boards", "Local experiences", "Travel brands"
-        ]
-    }
+        )
+    })
     
     @staticmethod
-    def get_brand_recommendations(persona: str) -> List[str]:
+    @functools.lru_cache(maxsize=None) # Pure lookup over a handful of personas
+    def get_brand_recommendations(persona: str) -> Tuple[str, ...]:
         """
         Get brand recommendations for a specific persona.
         
@@ -39,9 +45,9 @@ class ConsumerTypeAnalyzer:
             persona (str): The selected persona
             
         Returns:
-            List[str]: List of recommended brands
+            Tuple[str, ...]: Recommended brands
         """
         if persona == "ALL":
-            return ["Multi-segment brands", "Universal platforms", "Community-focused brands"]
+            return _ALL_BRANDS
         
-        return ConsumerTypeAnalyzer.PERSONA_BRANDS.get(persona, []) 
\ No newline at end of file
+        return ConsumerTypeAnalyzer.PERSONA_BRANDS.get(persona, ())
\ No newline at end of file
@@ -1,67 +1,108 @@
 import pandas as pd
 import numpy as np
+import logging
+
+logger = logging.getLogger("DataCleaner")
+
+def _to_datetime(series: pd.Series) -> pd.Series:
+    """Returns datetime columns untouched; parses string columns with an explicit ISO 8601 format."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pd.to_datetime(series, format='ISO8601', cache=True, errors='coerce')
+
+def ensure_datetime(df: pd.DataFrame, col: str = 'start_date') -> pd.DataFrame:
+    """
+    Returns df with col parsed to datetime. Frames whose column is already datetime
+    are returned as-is, so callers can use this freely without re-parsing.
+    """
+    if col not in df.columns or pd.api.types.is_datetime64_any_dtype(df[col]):
+        return df
+    return df.assign(**{col: _to_datetime(df[col])})
 
 class DataCleaner:
+    # Columns used anywhere downstream; everything else is dropped during cleaning.
+    # BigQueryDataLoader selects only these columns, so keep the two in sync.
+    KEEP_COLUMNS = [
+        'rental_id', 'duration', 'duration_ms', 'duration_minutes',
+        'start_date', 'end_date', 'start_date_time', 'end_date_time',
+        'hour', 'is_weekend', 'is_weekday',
+        'start_station_name', 'end_station_name',
+        'start_lat', 'start_lon', 'end_lat', 'end_lon',
+    ]
+
     @staticmethod
     def clean_bike_data(df: pd.DataFrame) -> pd.DataFrame:
+        # BigQueryDataLoader already filters and derives features in SQL, so for
+        # its output the branches below are cheap no-ops. They are kept as a
+        # safety net for frames coming from any other source.
         # Store original shape for reporting
         original_shape = df.shape
         
         # Standardize column names
-        df.columns = [col.lower() for col in df.columns]
-        
-        # Remove duplicate rows
-        df = df.drop_duplicates()
-        
-        # Drop columns with all NA
-        df = df.dropna(axis=1, how='all')
-        
-        # Remove rows where end coordinates are missing
-        # Note: The column names from your BigQuery query are 'end_lat' and 'end_lon'
-        # not 'end_latitude' and 'end_longitude'
-        if 'end_lat' in df.columns and 'end_lon' in df.columns:
-            rows_before = len(df)
-            df = df.dropna(subset=['end_lat', 'end_lon'])
-            rows_removed = rows_before - len(df)
-            if rows_removed > 0:
-                print(f"Removed {rows_removed} rows with missing end coordinates ({rows_removed/rows_before*100:.1f}%)")
-        
-        # Also remove rows where start coordinates are missing (optional but recommended)
-        if 'start_lat' in df.columns and 'start_lon' in df.columns:
-            rows_before = len(df)
-            df = df.dropna(subset=['start_lat', 'start_lon'])
-            rows_removed = rows_before - len(df)
-            if rows_removed > 0:
-                print(f"Removed {rows_removed} rows with missing start coordinates ({rows_removed/rows_before*100:.1f}%)")
+        df.columns = df.columns.str.lower()
+
+        # Keep only the columns the app uses
+        keep_cols = [col for col in DataCleaner.KEEP_COLUMNS if col in df.columns]
+        df = df.loc[:, keep_cols]
+        cols = set(keep_cols)
+
+        # Remove duplicate rows; rental_id is the primary key, so hashing it alone is enough
+        if 'rental_id' in cols:
+            df = df.drop_duplicates(subset=['rental_id'])
+        else:
+            df = df.drop_duplicates()
         
-        # Fill remaining NA values
-        for col in df.columns:
-            if pd.api.types.is_numeric_dtype(df[col]):
-                df[col] = df[col].fillna(0)
-            elif pd.api.types.is_bool_dtype(df[col]):
-                # Convert boolean columns to int to avoid NA ambiguity
-                df[col] = df[col].astype(float).fillna(0).astype(int)
-            else:
-                df[col] = df[col].fillna("")
+        if 'duration' in cols and 'duration_minutes' not in cols:
+            df['duration_minutes'] = df['duration'] / 60
+            cols.add('duration_minutes')
+
+        # Build a single row mask for all filters and apply it once:
+        # - rows missing end or start coordinates
+        #   (the BigQuery query names them 'end_lat'/'end_lon', not 'end_latitude'/'end_longitude')
+        # - trips with duration longer than 6 hours (360 minutes)
+        mask = np.ones(len(df), dtype=bool)
+        if {'end_lat', 'end_lon'} <= cols:
+            mask &= df['end_lat'].notna().to_numpy() & df['end_lon'].notna().to_numpy()
+        if {'start_lat', 'start_lon'} <= cols:
+            mask &= df['start_lat'].notna().to_numpy() & df['start_lon'].notna().to_numpy()
+        if 'duration_minutes' in cols:
+            # Missing durations are filled with 0 below, so they are not filtered here
+            mask &= ~(df['duration_minutes'] > 360).to_numpy(dtype=bool, na_value=False)
+        rows_removed = int(len(mask) - mask.sum())
+        # Always reset: drop_duplicates above can leave a gapped index even when the mask keeps every row
+        df = df.loc[mask].reset_index(drop=True)
+        if rows_removed > 0:
+            logger.info(f"Removed {rows_removed} rows with missing coordinates or duration over 6 hours ({rows_removed/len(mask)*100:.1f}%)")
 
-        if 'duration' in df.columns and 'duration_minutes' not in df.columns:
-                df['duration_minutes'] = df['duration'] / 60
+        # Fill remaining NA values, bucketing columns by dtype so pandas fills them in one pass
+        num_cols = df.select_dtypes(include='number').columns
+        bool_cols = df.select_dtypes(include=['bool', 'boolean']).columns
+        obj_cols = df.select_dtypes(include=['object', 'string']).columns
+        fill_values = {**dict.fromkeys(num_cols, 0), **dict.fromkeys(bool_cols, False), **dict.fromkeys(obj_cols, "")}
+        if fill_values:
+            df = df.fillna(fill_values)
+        # Convert boolean columns to int to avoid NA ambiguity
+        if len(bool_cols):
+            df[bool_cols] = df[bool_cols].astype('int8')
 
-        # Remove trips with duration longer than 6 hours (360 minutes)
-        if 'duration_minutes' in df.columns:
-            rows_before = len(df)
-            df = df[df['duration_minutes'] <= 360]
-            rows_removed = rows_before - len(df)
-            if rows_removed > 0:
-                print(f"Removed {rows_removed} trips with duration longer than 6 hours ({rows_removed/rows_before*100:.1f}%)")
+        if 'start_date' in cols and 'start_date_time' not in cols:
+            df['start_date_time'] = _to_datetime(df['start_date'])
 
-        if 'start_date' in df.columns and 'start_date_time' not in df.columns:
-            df['start_date_time'] = pd.to_datetime(df['start_date'])
+        if 'end_date' in cols and 'end_date_time' not in cols:
+            df['end_date_time'] = _to_datetime(df['end_date'])
 
-        if 'end_date' in df.columns and 'end_date_time' not in df.columns:
-            df['end_date_time'] = pd.to_datetime(df['end_date'])
+        # Shrink the frame: station names repeat heavily, and coordinates/durations don't need float64
+        for col in ['start_station_name', 'end_station_name']:
+            if col in cols:
+                df[col] = df[col].astype('category')
+        int_cols = df.select_dtypes(include='integer').columns
+        if len(int_cols):
+            df[int_cols] = df[int_cols].apply(pd.to_numeric, downcast='integer')
+        float_cols = df.select_dtypes(include='float').columns
+        if len(float_cols):
+            df[float_cols] = df[float_cols].astype('float32')
 
-        print(f"Data cleaned: {original_shape} -> {df.shape}")
+        logger.info(f"Data cleaned: {original_shape} -> {df.shape}")
         return df
     
     
\ No newline at end of file
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 from google.cloud import bigquery
+from google.cloud import bigquery_storage
 from google.oauth2 import service_account
 import os
 import streamlit as st
@@ -9,10 +10,42 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+STATIONS_TABLE = "bigquery-public-data.london_bicycles.cycle_stations"
+STATION_SQL = f"SELECT name, latitude, longitude FROM `{STATIONS_TABLE}` WHERE installed = true"
+DEMO_ROWS = 10000 # Size of the demo dataset when the limit allows it
+
+def _load_credentials(credentials_path):
+    if credentials_path and os.path.exists(credentials_path):
+        return service_account.Credentials.from_service_account_file(credentials_path)
+    return None
+
+@st.cache_resource # One client per (project, credentials) for the whole process
+def _get_client(project_id, credentials_path=None):
+    return bigquery.Client(credentials=_load_credentials(credentials_path), project=project_id)
+
+@st.cache_resource
+def _get_bq_storage(credentials_path=None):
+    return bigquery_storage.BigQueryReadClient(credentials=_load_credentials(credentials_path))
+
+@st.cache_data(ttl=3600) # Cache for 1 hour to avoid refetching
+def _load_station_data(project_id, credentials_path=None):
+    """
+    Loads the cycle station data with coordinates.
+    Lives at module level and takes only hashable arguments, so the cache is shared
+    by every BigQueryDataLoader instance and session using the same project.
+    """
+    print("Fetching station data from BigQuery (will be cached for 1 hour)...")
+    job = _get_client(project_id, credentials_path).query(STATION_SQL)
+    return job.to_dataframe(bqstorage_client=_get_bq_storage(credentials_path), create_bqstorage_client=False)
+
+class DataLoadError(Exception):
+    """Raised by BigQueryDataLoader.load_bike_data when BigQuery fails and demo fallback is off."""
+
 class BigQueryDataLoader:
     def __init__(self, project_id=None, dataset_id=None, table_id=None, credentials_path=None):
         self._using_demo_data = False
         self.client = None
+        self.bqstorage_client = None
         self.project_id = project_id or os.getenv("GOOGLE_CLOUD_PROJECT")
         self.dataset_id = dataset_id or "bigquery-public-data.london_bicycles"
         self.table_id = table_id or "cycle_hire"
@@ -21,15 +54,13 @@ class BigQueryDataLoader:
 
     def _initialize_client(self):
         try:
-            if self.credentials_path and os.path.exists(self.credentials_path):
-                credentials = service_account.Credentials.from_service_account_file(self.credentials_path)
-                self.client = bigquery.Client(credentials=credentials, project=self.project_id)
-            else:
-                self.client = bigquery.Client(project=self.project_id)
+            self.client = _get_client(self.project_id, self.credentials_path)
+            self.bqstorage_client = _get_bq_storage(self.credentials_path)
             self._test_connection()
         except Exception as e:
             print(f"Error initializing BigQuery client: {e}")
             self.client = None
+            self.bqstorage_client = None
 
     def _test_connection(self):
         try:
@@ -39,51 +70,71 @@ class BigQueryDataLoader:
             print(f"BigQuery connection test failed: {e}")
             self.client = None
 
-    @st.cache_data(ttl=3600) # Cache for 1 hour to avoid refetching
-    def load_station_data(_self):
+    def _query_to_dataframe(self, query):
+        """
+        Runs a query and downloads the results through the BigQuery Storage Read API.
+        Rows are streamed as Arrow record batches instead of paginated REST JSON.
+        """
+        job = self.client.query(query)
+        return job.to_dataframe(bqstorage_client=self.bqstorage_client, create_bqstorage_client=False)
+
+    def load_station_data(self):
         """
-        Loads and caches the cycle station data with coordinates.
-        The _self parameter is used because st.cache_data works on functions, not methods directly.
+        Loads the cycle station data with coordinates (cached for 1 hour per project).
         """
-        print("Fetching station data from BigQuery (will be cached for 1 hour)...")
-        if not _self.client:
+        if not self.client:
             print("Cannot load station data, BigQuery client not available.")
             return pd.DataFrame(columns=['name', 'latitude', 'longitude'])
 
-        stations_table = "bigquery-public-data.london_bicycles.cycle_stations"
-        query = f"SELECT name, latitude, longitude FROM `{stations_table}` WHERE installed = true"
         try:
-            df_stations = _self.client.query(query).to_dataframe()
-            return df_stations
+            return _load_station_data(self.project_id, self.credentials_path)
         except Exception as e:
             print(f"Error fetching station data: {e}")
             return pd.DataFrame(columns=['name', 'latitude', 'longitude'])
 
-    def load_bike_data(self, limit=50000):
+    def load_bike_data(self, limit=50000, demo_fallback=True):
         """
         Loads bike trip data and joins it with station coordinates directly in BigQuery.
+        Duration/coordinate filtering and the time features used for personas are
+        computed server-side, so the returned frame is already clean and typed.
+        With demo_fallback=False a failed load raises DataLoadError instead of
+        returning demo data, so callers can tell the two apart.
         """
+        # Only the columns in DataCleaner.KEEP_COLUMNS are selected; BigQuery bills by columns scanned
         full_trips_table = f"{self.dataset_id}.{self.table_id}"
-        stations_table = "bigquery-public-data.london_bicycles.cycle_stations"
 
         query = f"""
         WITH trips AS (
-            SELECT *
+            SELECT
+                rental_id, duration, start_date, end_date, start_station_name, end_station_name,
+                COALESCE(duration, duration_ms / 1000) / 60 AS duration_minutes
             FROM `{full_trips_table}`
             WHERE DATE(start_date) >= '2022-01-01' AND DATE(start_date) <= '2022-12-31'
+                AND start_station_name IS NOT NULL
+                AND COALESCE(duration, duration_ms / 1000) <= 360 * 60
             LIMIT {limit}
         )
         SELECT
-            trips.*,
+            trips.rental_id,
+            trips.duration,
+            trips.duration_minutes,
+            trips.start_date,
+            trips.end_date,
+            trips.start_station_name,
+            trips.end_station_name,
+            EXTRACT(HOUR FROM trips.start_date) AS hour,
+            IF(EXTRACT(DAYOFWEEK FROM trips.start_date) IN (1, 7), 1, 0) AS is_weekend,
+            IF(EXTRACT(DAYOFWEEK FROM trips.start_date) IN (1, 7), 0, 1) AS is_weekday,
             start_stn.latitude AS start_lat,
             start_stn.longitude AS start_lon,
             end_stn.latitude AS end_lat,
             end_stn.longitude AS end_lon
         FROM trips
-        LEFT JOIN `{stations_table}` AS start_stn
+        LEFT JOIN `{STATIONS_TABLE}` AS start_stn
             ON trips.start_station_name = start_stn.name
-        LEFT JOIN `{stations_table}` AS end_stn
+        LEFT JOIN `{STATIONS_TABLE}` AS end_stn
             ON trips.end_station_name = end_stn.name
+        WHERE start_stn.latitude IS NOT NULL AND end_stn.latitude IS NOT NULL
         """
 
         try:
@@ -91,7 +142,7 @@ class BigQueryDataLoader:
                 raise Exception("BigQuery client not initialized or connection failed")
             
             print("Executing JOIN query on BigQuery to fetch trips with coordinates...")
-            df = self.client.query(query).to_dataframe()
+            df = self._query_to_dataframe(query)
             print(f"Successfully loaded {len(df)} rows with coordinates.")
             
             # Ensure coordinate columns exist even if the query fails to create them
@@ -101,18 +152,25 @@ class BigQueryDataLoader:
             
             return df
         except Exception as e:
+            if not demo_fallback:
+                raise DataLoadError(f"BigQuery query failed: {e}") from e
             print(f"BigQuery query failed: {e}. Falling back to demo data.")
-            self._using_demo_data = True
-            return self._create_demo_data()
+            return self.load_demo_data(limit=limit)
 
-    def _create_demo_data(self):
+    def load_demo_data(self, limit=50000):
+        """
+        Returns the demo dataset without querying BigQuery, capped at limit rows.
+        """
+        self._using_demo_data = True
+        return self._create_demo_data(n_samples=min(limit, DEMO_ROWS))
+
+    def _create_demo_data(self, n_samples=DEMO_ROWS):
         """
         Create demo data when BigQuery is not available.
         This version now includes simulated coordinate columns to match the real query output.
         """
         print("Creating demo dataset...")
         np.random.seed(42)
-        n_samples = 10000
 
         station_names = [
             "Great Tower Street, Monument", "Grosvenor Road, Pimlico", "Exhibition Road, Knightsbridge",
@@ -120,28 +178,51 @@ class BigQueryDataLoader:
             "London Bridge Station, Southwark", "King's Cross Station, King's Cross", "Canary Wharf Station, Canary Wharf",
         ]
         
-        # Simulate coordinates for the demo stations
-        station_coords = {name: [51.5074 + np.random.uniform(-0.15, 0.15), -0.1278 + np.random.uniform(-0.2, 0.2)] for name in station_names}
-
-        data = {
-            'rental_id': range(1, n_samples + 1),
-            'duration': np.random.exponential(1200, n_samples),
-            'bike_id': np.random.randint(1, 1000, n_samples),
-            'start_date': pd.to_datetime(np.random.choice(pd.date_range('2022-01-01', '2022-12-31', freq='h'), n_samples)),
-            'start_station_name': np.random.choice(station_names, n_samples),
-            'end_station_name': np.random.choice(station_names, n_samples),
-        }
-        df = pd.DataFrame(data)
-
-        # Add derived columns that the rest of the app expects
-        df['end_date'] = df['start_date'] + pd.to_timedelta(df['duration'], unit='s')
-        df['duration_minutes'] = df['duration'] / 60
-        
-        # Add simulated coordinates by mapping from the station name
-        df['start_lat'] = df['start_station_name'].map(lambda x: station_coords.get(x, [None, None])[0])
-        df['start_lon'] = df['start_station_name'].map(lambda x: station_coords.get(x, [None, None])[1])
-        df['end_lat'] = df['end_station_name'].map(lambda x: station_coords.get(x, [None, None])[0])
-        df['end_lon'] = df['end_station_name'].map(lambda x: station_coords.get(x, [None, None])[1])
+        # Simulate coordinates for the demo stations, stored as parallel arrays indexed by station code
+        station_coords = np.array([[51.5074 + np.random.uniform(-0.15, 0.15), -0.1278 + np.random.uniform(-0.2, 0.2)] for _ in station_names])
+        station_lat = station_coords[:, 0].astype(np.float32)
+        station_lon = station_coords[:, 1].astype(np.float32)
+        station_index = pd.Index(station_names)
+
+        # Generate every column as a typed array first so the DataFrame is built in one step
+        duration = np.random.exponential(1200, n_samples)
+        bike_id = np.random.randint(1, 1000, n_samples).astype(np.int16)
+        # Start times on an hourly grid over 2022, sampled directly as int64 nanoseconds
+        hour_ns = np.int64(3600 * 10**9)
+        first_start_ns = np.int64(pd.Timestamp('2022-01-01').value)
+        n_start_hours = int((pd.Timestamp('2022-12-31').value - first_start_ns) // hour_ns) + 1
+        start_ns = first_start_ns + np.random.randint(0, n_start_hours, n_samples).astype(np.int64) * hour_ns
+        start_station_name = np.random.choice(station_names, n_samples)
+        end_station_name = np.random.choice(station_names, n_samples)
+
+        # Derived columns that the rest of the app expects
+        start_date = pd.DatetimeIndex(start_ns.view('datetime64[ns]'))
+        end_date = pd.DatetimeIndex((start_ns + (duration * 10**9).astype(np.int64)).view('datetime64[ns]'))
+        is_weekend = (start_date.weekday >= 5).astype(np.int8)
+
+        # Simulated coordinates, gathered from the station arrays with each row's station code
+        start_codes = station_index.get_indexer(start_station_name)
+        end_codes = station_index.get_indexer(end_station_name)
+
+        df = pd.DataFrame({
+            'rental_id': np.arange(1, n_samples + 1, dtype=np.int32),
+            'duration': duration.astype(np.float32),
+            'bike_id': bike_id,
+            'start_date': start_date,
+            'start_station_name': start_station_name,
+            'end_station_name': end_station_name,
+            'end_date': end_date,
+            'duration_minutes': (duration / 60).astype(np.float32),
+            'start_date_time': start_date,
+            'end_date_time': end_date,
+            'hour': start_date.hour.astype(np.int8),
+            'is_weekend': is_weekend,
+            'is_weekday': 1 - is_weekend,
+            'start_lat': station_lat.take(start_codes),
+            'start_lon': station_lon.take(start_codes),
+            'end_lat': station_lat.take(end_codes),
+            'end_lon': station_lon.take(end_codes),
+        })
 
         print("Created demo data with simulated coordinates.")
         return df
@@ -1,32 +1,137 @@
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
+from sklearn.cluster import KMeans, MiniBatchKMeans
 import logging
+import functools
+import importlib.util
+from utils.data_cleaner import ensure_datetime
+
+try:
+    from numba import njit, prange
+except ImportError:
+    # numba is optional; without it the rules below run as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
+    prange = range
+
+# Fixed mapping of K-means cluster numbers to persona names, based on the cluster analysis results
+_FIXED_PERSONA_NAMES = (
+    "Evening Commuter",      # Cluster 0: short rides, evening hours, weekday
+    "Weekend Explorer",      # Cluster 1: slightly longer trips, afternoon, weekend
+    "Morning Commuter",      # Cluster 2: short rides, morning hours, weekday
+    "Tourist/Long Leisure",  # Cluster 3: very long trips, mixed days
+    "Fitness",               # Cluster 4: moderate-long duration, afternoon (Fitness/Casual Long)
+)
+
+# Persona names indexed by the codes _persona_code returns
+_PERSONA_NAMES = ('General User', 'Tourist/Long Leisure', 'Weekend Explorer', 'Fitness', 'Evening Commuter', 'Morning Commuter')
+
+@njit(cache=True)
+def _persona_code(duration, hour, is_weekend, is_weekday):
+    """
+    Business rules behind assign_persona_rule_based on plain scalars, returning an index into _PERSONA_NAMES.
+    """
+    # Tourist/Long Leisure - Very long trips, mixed days
+    # Based on Cluster 3 characteristics: very long trips, mixed days
+    if duration > 90:
+        return 1  # Tourist/Long Leisure
+    
+    # Weekend Explorer - Slightly longer trips, afternoon, weekend
+    # Based on Cluster 1 characteristics: weekend, afternoon hours, moderate duration
+    if (is_weekend and 30 <= duration <= 70 and 12 <= hour <= 18):
+        return 2  # Weekend Explorer
+    
+    # Fitness - Moderate-long duration, afternoon, weekday
+    # Based on Cluster 4 characteristics: moderate-long duration, afternoon, weekday
+    if (is_weekday and 45 <= duration <= 80 and 14 <= hour <= 19):
+        return 3  # Fitness
+    
+    # Evening Commuter - Short rides, evening hours, weekday
+    # Based on Cluster 0 characteristics: short rides, evening hours, weekday
+    if (is_weekday and duration < 30 and 16 <= hour <= 21):
+        return 4  # Evening Commuter
+    
+    # Morning Commuter - Short rides, morning hours, weekday
+    # Based on Cluster 2 characteristics: short rides, morning hours, weekday
+    if (is_weekday and duration < 30 and 6 <= hour <= 11):
+        return 5  # Morning Commuter
+    
+    # Additional rules for edge cases
+    
+    # Weekend morning fitness/leisure
+    if (is_weekend and 20 <= duration <= 60 and 7 <= hour <= 12):
+        return 2  # Weekend Explorer
+    
+    # Late night rides (likely evening commuters)
+    if (is_weekday and duration < 35 and (hour >= 22 or hour <= 2)):
+        return 4  # Evening Commuter
+    
+    # Early morning fitness
+    if (is_weekday and 30 <= duration <= 70 and 5 <= hour <= 8):
+        return 3  # Fitness
+    
+    # Long weekend rides
+    if (is_weekend and 60 <= duration <= 90):
+        return 1  # Tourist/Long Leisure
+    
+    # Default fallback based on most common patterns
+    if is_weekend:
+        return 2  # Weekend Explorer
+    elif hour < 12:
+        return 5  # Morning Commuter
+    elif hour >= 16:
+        return 4  # Evening Commuter
+    else:
+        return 3  # Fitness
+
+@njit(parallel=True, cache=True)
+def _persona_codes_batch(duration, hour, is_weekend, is_weekday, out):
+    """
+    Fills out with _persona_code for every row of the input arrays, in parallel when numba is installed.
+    """
+    for i in prange(out.shape[0]):
+        out[i] = _persona_code(duration[i], hour[i], is_weekend[i], is_weekday[i])
 
 class PersonaGenerator:
     """
     Assigns personas to rows in a DataFrame using either rule-based or K-means clustering.
     """
     
-    def __init__(self, n_clusters=5, random_state=42):
+    # Below this many rows full-batch KMeans is cheap enough and is used even when use_minibatch is set
+    MINIBATCH_MIN_ROWS = 20_000
+
+    def __init__(self, n_clusters=5, random_state=42, use_minibatch=False, backend='sklearn'):
         """
         Initialize the PersonaGenerator with clustering parameters.
         
         Args:
             n_clusters (int): Number of clusters for K-means (default: 5)
             random_state (int): Random state for reproducibility (default: 42)
+            use_minibatch (bool): Use MiniBatchKMeans for large inputs (default: False). Mini-batch
+                cluster ids differ from full KMeans, so the fixed persona names no longer match the
+                clusters they were derived from; enable only when approximate labels are acceptable
+            backend (str): 'sklearn', 'cuml' for GPU KMeans, or 'auto' to use cuML when it is installed
+                (default: 'sklearn'). cuML initialises and numbers clusters differently, so its persona
+                labels can differ from scikit-learn's; it is only used when asked for
         """
+        if backend not in ('auto', 'sklearn', 'cuml'):
+            raise ValueError(f"Unknown clustering backend: {backend}")
+        # Fail here rather than in assign_persona_clustering, whose rule-based fallback would hide it
+        if backend == 'cuml' and importlib.util.find_spec('cuml') is None:
+            raise ImportError("backend='cuml' requires cuML, which is not installed")
         self.n_clusters = n_clusters
         self.random_state = random_state
+        self.use_minibatch = use_minibatch
+        self.backend = backend
         self.kmeans = None
-        self.scaler = StandardScaler()
         self.logger = logging.getLogger("PersonaGenerator")
 
     @staticmethod
     def assign_persona_rule_based(row):
         """
         Rule-based persona assignment using hardcoded business rules.
+        Deprecated: kept only for single-row callers of the public API. Use
+        assign_persona_rule_based_vectorized for DataFrames.
         Uses the same 5 personas as K-means clustering and considers all 4 dimensions:
         duration_minutes, hour, is_weekend, is_weekday.
         
@@ -72,58 +177,76 @@ class PersonaGenerator:
         if duration is None or hour is None:
             return 'General User'
         
-        # Tourist/Long Leisure - Very long trips, mixed days
-        # Based on Cluster 3 characteristics: very long trips, mixed days
-        if duration > 90:
-            return 'Tourist/Long Leisure'
-        
-        # Weekend Explorer - Slightly longer trips, afternoon, weekend
-        # Based on Cluster 1 characteristics: weekend, afternoon hours, moderate duration
-        if (is_weekend and 30 <= duration <= 70 and 12 <= hour <= 18):
-            return 'Weekend Explorer'
-        
-        # Fitness - Moderate-long duration, afternoon, weekday
-        # Based on Cluster 4 characteristics: moderate-long duration, afternoon, weekday
-        if (is_weekday and 45 <= duration <= 80 and 14 <= hour <= 19):
-            return 'Fitness'
-        
-        # Evening Commuter - Short rides, evening hours, weekday
-        # Based on Cluster 0 characteristics: short rides, evening hours, weekday
-        if (is_weekday and duration < 30 and 16 <= hour <= 21):
-            return 'Evening Commuter'
-        
-        # Morning Commuter - Short rides, morning hours, weekday
-        # Based on Cluster 2 characteristics: short rides, morning hours, weekday
-        if (is_weekday and duration < 30 and 6 <= hour <= 11):
-            return 'Morning Commuter'
-        
-        # Additional rules for edge cases
-        
-        # Weekend morning fitness/leisure
-        if (is_weekend and 20 <= duration <= 60 and 7 <= hour <= 12):
-            return 'Weekend Explorer'
-        
-        # Late night rides (likely evening commuters)
-        if (is_weekday and duration < 35 and (hour >= 22 or hour <= 2)):
-            return 'Evening Commuter'
-        
-        # Early morning fitness
-        if (is_weekday and 30 <= duration <= 70 and 5 <= hour <= 8):
-            return 'Fitness'
-        
-        # Long weekend rides
-        if (is_weekend and 60 <= duration <= 90):
-            return 'Tourist/Long Leisure'
+        return _PERSONA_NAMES[_persona_code(float(duration), float(hour), bool(is_weekend), bool(is_weekday))]
+
+    @classmethod
+    def assign_persona_rule_based_vectorized(cls, df):
+        """
+        Rule-based persona assignment over a whole DataFrame, using hardcoded business rules.
+        Uses the same 5 personas as K-means clustering and considers all 4 dimensions:
+        duration_minutes, hour, is_weekend, is_weekday. Every row goes through the same
+        _persona_code as the row version, in one compiled batch. Every row is labelled
+        'General User' when no duration or hour column is available at all, and a row is
+        when its hour has to come from a start_date that cannot be parsed; other NaN
+        values fall through the rules to the default persona.
         
-        # Default fallback based on most common patterns
-        if is_weekend:
-            return 'Weekend Explorer'
-        elif hour < 12:
-            return 'Morning Commuter'
-        elif hour >= 16:
-            return 'Evening Commuter'
+        Args:
+            df (pd.DataFrame): DataFrame with trip data
+            
+        Returns:
+            pd.Series: Persona name for each row, aligned to df.index
+        """
+        n = len(df)
+        is_weekend = df['is_weekend'].to_numpy(dtype=float, na_value=0) != 0 if 'is_weekend' in df.columns else np.zeros(n, dtype=bool)
+        is_weekday = df['is_weekday'].to_numpy(dtype=float, na_value=0) != 0 if 'is_weekday' in df.columns else np.zeros(n, dtype=bool)
+        unset_days = ~is_weekend & ~is_weekday
+
+        # Parse start_date once, and only if some value has to be derived from it
+        start_datetime = None
+        if 'start_date' in df.columns and ('hour' not in df.columns or unset_days.any()):
+            start_datetime = ensure_datetime(df)['start_date']
+
+        # Extract basic values, falling back to start_date / raw duration columns when missing
+        if 'duration_minutes' in df.columns:
+            duration = df['duration_minutes'].to_numpy(dtype=float, na_value=np.nan)
+        elif 'duration' in df.columns:
+            duration = df['duration'].to_numpy(dtype=float, na_value=np.nan) / 60
+        elif 'duration_ms' in df.columns:
+            duration = df['duration_ms'].to_numpy(dtype=float, na_value=np.nan) / 60000
+        else:
+            duration = None
+
+        # Rows whose hour has to come from a start_date that doesn't parse have no hour at all
+        no_hour = None
+        if 'hour' in df.columns:
+            hour = df['hour'].to_numpy(dtype=float, na_value=np.nan)
+        elif start_datetime is not None:
+            hour = start_datetime.dt.hour.to_numpy(dtype=float, na_value=np.nan)
+            no_hour = start_datetime.isna().to_numpy()
         else:
-            return 'Fitness'
+            hour = None
+
+        # Handle missing values
+        if duration is None or hour is None:
+            return pd.Series('General User', index=df.index, dtype=object, name='persona')
+
+        if start_datetime is not None:
+            # Rows with neither flag set take them from start_date
+            weekday = start_datetime.dt.weekday.to_numpy(dtype=float, na_value=np.nan)
+            is_weekend = np.where(unset_days, weekday >= 5, is_weekend)
+            is_weekday = np.where(unset_days, weekday < 5, is_weekday)
+
+        # The rules themselves live only in _persona_code; the batch kernel runs them over every row
+        codes = np.empty(n, dtype=np.int8)
+        _persona_codes_batch(
+            np.ascontiguousarray(duration, dtype=np.float64), np.ascontiguousarray(hour, dtype=np.float64),
+            np.ascontiguousarray(is_weekend, dtype=np.bool_), np.ascontiguousarray(is_weekday, dtype=np.bool_), codes
+        )
+        if no_hour is not None:
+            # Like a missing hour column, an unparseable start_date leaves the row a 'General User'
+            codes[no_hour] = 0
+        personas = np.asarray(_PERSONA_NAMES, dtype=object).take(codes)
+        return pd.Series(personas, index=df.index, dtype=object, name='persona')
 
     def assign_persona_clustering(self, df):
         """
@@ -137,33 +260,37 @@ class PersonaGenerator:
             pd.DataFrame: DataFrame with 'persona' column added
         """
         try:
-            df_work = df.copy()
-            
-            # Ensure required columns exist by creating them from start_date if needed
-            if 'start_date' in df_work.columns:
-                start_datetime = pd.to_datetime(df_work['start_date'], errors='coerce')
+            # Ensure required columns exist by creating them from start_date if needed.
+            # New columns are collected and added with assign, which under copy-on-write
+            # shares the untouched columns with df instead of copying the whole frame.
+            new_columns = {}
+            if 'start_date' in df.columns and not {'hour', 'is_weekend', 'is_weekday'}.issubset(df.columns):
+                df = ensure_datetime(df)
+                start_datetime = df['start_date']
                 
                 # Create hour column if it doesn't exist
-                if 'hour' not in df_work.columns:
-                    df_work['hour'] = start_datetime.dt.hour
+                if 'hour' not in df.columns:
+                    new_columns['hour'] = start_datetime.dt.hour.astype('int8')
                 
                 # Create is_weekend column if it doesn't exist
-                if 'is_weekend' not in df_work.columns:
-                    df_work['is_weekend'] = (start_datetime.dt.weekday >= 5).astype(int)
+                if 'is_weekend' not in df.columns:
+                    new_columns['is_weekend'] = (start_datetime.dt.weekday >= 5).astype('int8')
                 
                 # Create is_weekday column if it doesn't exist
-                if 'is_weekday' not in df_work.columns:
-                    df_work['is_weekday'] = (start_datetime.dt.weekday < 5).astype(int)
+                if 'is_weekday' not in df.columns:
+                    new_columns['is_weekday'] = (start_datetime.dt.weekday < 5).astype('int8')
             
             # Create duration_minutes if it doesn't exist
-            if 'duration_minutes' not in df_work.columns:
-                if 'duration' in df_work.columns:
-                    df_work['duration_minutes'] = df_work['duration'] / 60
-                elif 'duration_ms' in df_work.columns:
-                    df_work['duration_minutes'] = df_work['duration_ms'] / 60000
+            if 'duration_minutes' not in df.columns:
+                if 'duration' in df.columns:
+                    new_columns['duration_minutes'] = df['duration'] / 60
+                elif 'duration_ms' in df.columns:
+                    new_columns['duration_minutes'] = df['duration_ms'] / 60000
                 else:
                     raise ValueError("No duration column found. Need 'duration', 'duration_ms', or 'duration_minutes'")
             
+            df_work = df.assign(**new_columns) if new_columns else df
+            
             # Ensure required columns exist
             required_columns = ['duration_minutes', 'hour', 'is_weekend', 'is_weekday']
             missing_columns = [col for col in required_columns if col not in df_work.columns]
@@ -172,73 +299,99 @@ class PersonaGenerator:
                 raise ValueError(f"Missing required columns after auto-creation: {missing_columns}")
             
             # Select features for clustering
-            features = df_work[required_columns].copy()
+            features = df_work[required_columns]
             
-            # Handle missing values
-            features = features.fillna(features.mean())
+            # Handle missing values; float32 halves the memory traffic of scaling and every KMeans iteration
+            features = features.fillna(features.mean()).astype(np.float32)
             
             # Standardize features
-            X = self.scaler.fit_transform(features)
+            X = self._standardize(features.to_numpy())
             
             # Perform K-means clustering
-            self.kmeans = KMeans(n_clusters=self.n_clusters, random_state=self.random_state)
-            cluster_labels = self.kmeans.fit_predict(X)
+            cluster_labels = self._fit_predict(X)
             
-            # Create persona names based on cluster characteristics
-            persona_names = self._generate_persona_names(df_work, cluster_labels)
+            # Fixed persona name for each cluster number
+            persona_names = self._generate_persona_names(self.n_clusters)
             
             # Add persona column to DataFrame
-            df_result = df.copy()
-            df_result['persona'] = [persona_names[label] for label in cluster_labels]
-            df_result['cluster'] = cluster_labels
-            
-            return df_result
+            return df.assign(persona=pd.Categorical.from_codes(cluster_labels, categories=persona_names), cluster=cluster_labels)
             
         except Exception as e:
             self.logger.error(f"Error in assign_persona_clustering: {e}")
             # Fallback to rule-based assignment
-            df_result = df.copy()
-            df_result['persona'] = df.apply(self.assign_persona_rule_based, axis=1)
-            return df_result
+            return df.assign(persona=self.assign_persona_rule_based_vectorized(df))
 
-    def _generate_persona_names(self, df, cluster_labels):
+    def _fit_predict(self, X):
         """
-        Fixed mapping of cluster numbers to specific persona names.
-        Based on the user's cluster analysis results:
-        - Cluster 0: Evening Commuter (short rides, evening hours, weekday)
-        - Cluster 1: Weekend Explorer (slightly longer trips, afternoon, weekend)
-        - Cluster 2: Morning Commuter (short rides, morning hours, weekday)
-        - Cluster 3: Tourist/Long Leisure (very long trips, mixed days)
-        - Cluster 4: Fitness/Casual Long (moderate-long duration, afternoon)
+        Fit K-means on the standardized features and return a cluster label per row.
+        Runs with scikit-learn unless the backend asks for cuML ('cuml', or 'auto' with
+        cuML installed), in which case it runs on the GPU.
         
         Args:
-            df (pd.DataFrame): Original DataFrame
-            cluster_labels (np.array): Cluster labels from K-means
+            X (np.ndarray): Standardized float32 feature matrix
             
         Returns:
-            list: List of persona names for each cluster
+            np.ndarray: Cluster label for each row
         """
-        # Fixed mapping based on user's cluster analysis
-        fixed_persona_mapping = {
-            0: "Evening Commuter",      # 🔵 Cluster 0 → Evening Commuter
-            1: "Weekend Explorer",      # 🟣 Cluster 1 → Weekend Explorer
-            2: "Morning Commuter",      # 🔵 Cluster 2 → Morning Commuter  
-            3: "Tourist/Long Leisure", # 🔴 Cluster 3 → Tourist/Long Leisure
-            4: "Fitness"   # 🟡 Cluster 4 → Fitness/Casual Long
-        }
-        
-        # Generate persona names using fixed mapping
-        persona_names = []
-        for cluster_id in range(self.n_clusters):
-            if cluster_id in fixed_persona_mapping:
-                persona_names.append(fixed_persona_mapping[cluster_id])
+        if self.backend != 'sklearn':
+            try:
+                from cuml.cluster import KMeans as cuKMeans
+            except ImportError:
+                if self.backend == 'cuml':
+                    raise
+                self.logger.info("cuML not available, clustering with scikit-learn")
             else:
-                persona_names.append(f"Cluster_{cluster_id}")
+                self.kmeans = cuKMeans(n_clusters=self.n_clusters, random_state=self.random_state, output_type='numpy')
+                return np.asarray(self.kmeans.fit_predict(X))
         
-        return persona_names
+        # Mini-batches converge far faster on large inputs, at the cost of different cluster ids
+        if self.use_minibatch and len(X) >= self.MINIBATCH_MIN_ROWS:
+            self.kmeans = MiniBatchKMeans(
+                n_clusters=self.n_clusters, batch_size=min(4096, len(X)), n_init=3, max_iter=100,
+                random_state=self.random_state, reassignment_ratio=0.01
+            )
+        else:
+            self.kmeans = KMeans(n_clusters=self.n_clusters, random_state=self.random_state)
+        return self.kmeans.fit_predict(X)
+
+    @staticmethod
+    def _standardize(X):
+        """
+        Scale each feature column to zero mean and unit variance, like StandardScaler.fit_transform
+        but without its validation and copies. Constant columns are only centred.
+        
+        Args:
+            X (np.ndarray): 2-D feature matrix
+            
+        Returns:
+            np.ndarray: Contiguous float32 standardized features
+        """
+        mean = X.mean(axis=0, dtype=np.float64)
+        std = X.std(axis=0, dtype=np.float64)
+        std[std == 0] = 1.0
+        out = np.empty(X.shape, dtype=np.float32)
+        np.divide(X - mean, std, out=out, casting='same_kind')
+        return out
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _generate_persona_names(n_clusters):
+        """
+        Fixed mapping of cluster numbers to specific persona names (see _FIXED_PERSONA_NAMES).
+        Clusters beyond the fixed mapping are named Cluster_<n>.
+        
+        Args:
+            n_clusters (int): Number of clusters
+            
+        Returns:
+            tuple: Persona name for each cluster number
+        """
+        return _FIXED_PERSONA_NAMES[:n_clusters] + tuple(
+            f"Cluster_{cluster_id}" for cluster_id in range(len(_FIXED_PERSONA_NAMES), n_clusters)
+        )
 
     @classmethod
-    def add_persona_column(cls, df: pd.DataFrame, use_clustering=True, n_clusters=5) -> pd.DataFrame:
+    def add_persona_column(cls, df: pd.DataFrame, use_clustering=True, n_clusters=5, use_minibatch=False, backend='sklearn') -> pd.DataFrame:
         """
         Adds a 'persona' column to the DataFrame.
         Automatically handles column creation and method selection.
@@ -247,6 +400,10 @@ class PersonaGenerator:
             df (pd.DataFrame): Input DataFrame
             use_clustering (bool): Whether to use clustering (True) or rule-based (False)
             n_clusters (int): Number of clusters for K-means (default: 5)
+            use_minibatch (bool): Cluster large inputs with MiniBatchKMeans (default: False);
+                see PersonaGenerator.__init__ for why its persona labels are approximate
+            backend (str): Clustering backend, 'sklearn', 'cuml' or 'auto' (default: 'sklearn');
+                see PersonaGenerator.__init__
             
         Returns:
             pd.DataFrame: DataFrame with 'persona' column added
@@ -260,10 +417,11 @@ class PersonaGenerator:
         
         if use_clustering:
             # Use clustering approach
-            generator = cls(n_clusters=n_clusters)
-            return generator.assign_persona_clustering(df)
+            generator = cls(n_clusters=n_clusters, use_minibatch=use_minibatch, backend=backend)
+            result = generator.assign_persona_clustering(df)
         else:
             # Use rule-based approach
-            df_result = df.copy()
-            df_result['persona'] = df.apply(cls.assign_persona_rule_based, axis=1)
-            return df_result
\ No newline at end of file
+            result = df.assign(persona=cls.assign_persona_rule_based_vectorized(df))
+        
+        # Only a handful of distinct personas, so store them as a category
+        return result.assign(persona=result['persona'].astype('category'))
\ No newline at end of file
@@ -1,15 +1,83 @@
 import pandas as pd
-from typing import Dict, Any
+import numpy as np
+from typing import Dict, Any, Optional
+from utils.data_cleaner import ensure_datetime
 
-def compute_marketing_stats(df: pd.DataFrame, persona: str) -> Dict[str, Any]:
+def _counts_by_code(series: pd.Series) -> pd.Series:
+    """
+    Counts rows per category of a categorical Series in one np.bincount pass over its codes.
+    Every category is present in the result, unused ones with a count of 0.
+    """
+    codes = series.cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories))
+    return pd.Series(counts, index=series.cat.categories)
+
+def _top_stations(df: pd.DataFrame, prefix: str, coords: Dict[str, list], n: int = 5):
+    """
+    Returns the n busiest '<prefix>_station_name' stations as a {name: count} dict plus
+    a list of {name, count, lat, lon} records for those found in coords.
+    Ties are ordered like value_counts().head(n): stations are taken in order of first
+    appearance and then sorted by count.
+    """
+    names = df[f'{prefix}_station_name']
+    counts = _counts_by_code(names)
+    codes = names.cat.codes.to_numpy()
+    top = counts.iloc[pd.unique(codes[codes >= 0])].sort_values(ascending=False).head(n)
+    with_coords = [
+        {'name': name, 'count': int(count), 'lat': coords[name][0], 'lon': coords[name][1]}
+        for name, count in top.items() if name in coords
+    ]
+    return {name: int(count) for name, count in top.items()}, with_coords
+
+def _station_coords(df: pd.DataFrame, prefix: str) -> Dict[str, list]:
+    """
+    Map each {prefix}_station_name to its first known [lat, lon].
+    """
+    name_col, lat_col, lon_col = f'{prefix}_station_name', f'{prefix}_lat', f'{prefix}_lon'
+    coords = df[[name_col, lat_col, lon_col]].dropna().drop_duplicates(name_col).set_index(name_col)
+    return dict(zip(coords.index, coords[[lat_col, lon_col]].values.tolist()))
+
+class MarketingContext:
+    """
+    Full-dataset state shared by every compute_marketing_stats call on the same trips frame:
+    the prepared frame (parsed start_date, categorical station names), trips per start
+    station, and start/end station coordinates. Build it once per loaded dataset.
+    """
+    
+    def __init__(self, df: pd.DataFrame):
+        # Parse start_date once up front so persona subsets share the parsed column
+        df = ensure_datetime(df)
+        # Station names are grouped on repeatedly; categorical codes keep those groupbys cheap
+        station_casts = {
+            col: df[col].astype('category')
+            for col in ('start_station_name', 'end_station_name')
+            if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype)
+        }
+        if station_casts:
+            df = df.assign(**station_casts)
+        self.df = df
+        self.station_totals = _counts_by_code(df['start_station_name'])
+        self.start_coords = _station_coords(df, 'start')
+        self.end_coords = _station_coords(df, 'end')
+
+def compute_marketing_stats(df: pd.DataFrame, persona: str, persona_rows: Optional[np.ndarray] = None,
+                            ctx: Optional[MarketingContext] = None) -> Dict[str, Any]:
     """
     Compute marketing-relevant statistics for a given persona.
     Generates data for top stations, corridors, and a complete station footprint.
+    If given, persona_rows holds the positional row indices of the persona's trips
+    (e.g. from groupby('persona').indices) and is used instead of a boolean mask.
+    Pass a MarketingContext built from df to reuse its full-dataset aggregates across calls.
     """
-    full_df = df.copy()
+    if ctx is None:
+        ctx = MarketingContext(df)
+    df = ctx.df
     
     if persona != "ALL":
-        df = df[df["persona"] == persona].copy()
+        if persona_rows is not None:
+            df = df.take(persona_rows)
+        else:
+            df = df.loc[df["persona"] == persona]
     
     stats = {}
     if df.empty:
@@ -18,95 +86,61 @@ def compute_marketing_stats(df: pd.DataFrame, persona: str) -> Dict[str, Any]:
     # --- DESCRIPTIVE STATS ---
     stats["trip_count"] = len(df)
     
-    top_start_counts = df["start_station_name"].value_counts().head(5)
-    stats["top_start_stations"] = top_start_counts.to_dict()
-    top_end_counts = df["end_station_name"].value_counts().head(5)
-    stats["top_end_stations"] = top_end_counts.to_dict()
-    
-    # --- Coordinate Data Generation ---
-    start_coord_lookup = df.dropna(subset=['start_lat', 'start_lon']).drop_duplicates(subset=['start_station_name']).set_index('start_station_name')
-    end_coord_lookup = df.dropna(subset=['end_lat', 'end_lon']).drop_duplicates(subset=['end_station_name']).set_index('end_station_name')
-
-    top_starts_with_coords = []
-    for station_name, count in top_start_counts.items():
-        if station_name in start_coord_lookup.index:
-            station_details = start_coord_lookup.loc[station_name]
-            top_starts_with_coords.append({'name': station_name, 'count': int(count), 'lat': station_details['start_lat'], 'lon': station_details['start_lon']})
-    stats['top_start_stations_with_coords'] = top_starts_with_coords
-    
-    top_ends_with_coords = []
-    for station_name, count in top_end_counts.items():
-        if station_name in end_coord_lookup.index:
-            station_details = end_coord_lookup.loc[station_name]
-            top_ends_with_coords.append({'name': station_name, 'count': int(count), 'lat': station_details['end_lat'], 'lon': station_details['end_lon']})
-    stats['top_end_stations_with_coords'] = top_ends_with_coords
+    stats["top_start_stations"], stats['top_start_stations_with_coords'] = _top_stations(df, 'start', ctx.start_coords)
+    stats["top_end_stations"], stats['top_end_stations_with_coords'] = _top_stations(df, 'end', ctx.end_coords)
     
     # Get ALL unique stations used by the persona for map display
     if persona != "ALL":
-        # Get start station counts
-        start_station_counts = df['start_station_name'].value_counts()
-        end_station_counts = df['end_station_name'].value_counts()
-        
-        # Create start stations with counts
-        start_stations = df[['start_station_name', 'start_lat', 'start_lon']].rename(columns={'start_station_name': 'name', 'start_lat': 'lat', 'start_lon': 'lon'})
-        start_stations['count'] = start_stations['name'].map(start_station_counts)
-        
-        # Create end stations with counts
-        end_stations = df[['end_station_name', 'end_lat', 'end_lon']].rename(columns={'end_station_name': 'name', 'end_lat': 'lat', 'end_lon': 'lon'})
-        end_stations['count'] = end_stations['name'].map(end_station_counts)
-        
-        # Combine and aggregate counts for stations that appear as both start and end
-        all_persona_stations = pd.concat([start_stations, end_stations]).dropna()
-        all_persona_stations = all_persona_stations.groupby(['name', 'lat', 'lon'])['count'].sum().reset_index()
-        
-        stats['persona_stations_with_coords'] = all_persona_stations.to_dict('records')
+        # Count trips per start and per end station, then add the two counts for stations used as both
+        station_counts = _counts_by_code(df['start_station_name']).add(_counts_by_code(df['end_station_name']), fill_value=0)
+        station_coords = {**ctx.end_coords, **ctx.start_coords}
+        stats['persona_stations_with_coords'] = [
+            {'name': name, 'lat': station_coords[name][0], 'lon': station_coords[name][1], 'count': int(count)}
+            for name, count in station_counts[station_counts > 0].items() if name in station_coords
+        ]
     else:
         stats['persona_stations_with_coords'] = []
 
     # --- PRESCRIPTIVE #1: TOP TRAVEL CORRIDORS ---
-    corridor_counts = df.groupby(['start_station_name', 'end_station_name']).agg(
-        count=('rental_id', 'size'),
-        start_lat=('start_lat', 'first'), start_lon=('start_lon', 'first'),
-        end_lat=('end_lat', 'first'), end_lon=('end_lon', 'first')
-    ).sort_values(by='count', ascending=False).head(5)
+    # Sorted groups then a count sort, so ties come out in the same order as the original sorted groupby
+    corridor_counts = df.groupby(['start_station_name', 'end_station_name'], observed=True).size().sort_values(ascending=False).head(5)
     
-    formatted_corridors = {f"{start} → {end}": data['count'] for (start, end), data in corridor_counts.iterrows()}
+    formatted_corridors = {f"{start} → {end}": int(count) for (start, end), count in corridor_counts.items()}
     stats["top_travel_corridors"] = formatted_corridors
     
+    # Coordinates depend only on the station, so look them up for the chosen corridors
+    # instead of carrying them through the groupby
     corridors_with_coords = []
-    for (start, end), data in corridor_counts.iterrows():
-        if pd.notna(data['start_lat']) and pd.notna(data['end_lat']):
+    for (start, end), count in corridor_counts.items():
+        if start in ctx.start_coords and end in ctx.end_coords:
             corridors_with_coords.append({
-                "route_name": f"{start} → {end}", "count": int(data['count']),
-                "start_coords": [data['start_lat'], data['start_lon']], "end_coords": [data['end_lat'], data['end_lon']]
+                "route_name": f"{start} → {end}", "count": int(count),
+                "start_coords": ctx.start_coords[start], "end_coords": ctx.end_coords[end]
             })
     stats["top_travel_corridors_with_coords"] = corridors_with_coords
 
     # --- PRESCRIPTIVE #2: HIGH CONCENTRATION STATIONS ---
     if persona != "ALL":
-        station_persona_counts = df.groupby('start_station_name').size()
-        station_total_counts = full_df.groupby('start_station_name').size()
-        concentration_data = []
-        overall_persona_ratio = (len(df) / len(full_df)) * 100
-        for station in station_total_counts.index:
-            total_trips = station_total_counts.get(station, 0)
-            persona_trips = station_persona_counts.get(station, 0)
-            if total_trips >= 10:
-                concentration_pct = (persona_trips / total_trips) * 100
-                relative_concentration = concentration_pct / overall_persona_ratio if overall_persona_ratio > 0 else 0
-                concentration_data.append({'station': station, 'persona_trips': persona_trips, 'total_trips': total_trips, 'concentration_pct': concentration_pct, 'relative_concentration': relative_concentration})
+        overall_persona_ratio = (len(df) / len(ctx.df)) * 100
+        # The persona subset shares ctx.df's categories, so both counts line up station for station
+        concentration_df = ctx.station_totals.to_frame('total_trips').assign(persona_trips=_counts_by_code(df['start_station_name']))
+        concentration_df = concentration_df[concentration_df['total_trips'] >= 10]
+        # assign returns a new frame, so the filtered frame is never written to in place
+        concentration_df = concentration_df.assign(
+            concentration_pct=lambda d: (d['persona_trips'] / d['total_trips']) * 100,
+            relative_concentration=lambda d: d['concentration_pct'] / overall_persona_ratio if overall_persona_ratio > 0 else 0,
+        )
+        concentration_df = concentration_df.rename_axis('station').reset_index()
         
-        concentration_df = pd.DataFrame(concentration_data)
         if not concentration_df.empty:
             top_concentration_stations = concentration_df.nlargest(5, 'relative_concentration')
             stats["opportunity_stations"] = {row['station']: {'Persona %': f"{row['concentration_pct']:.1f}%", 'Concentration': f"{row['relative_concentration']:.2f}x", 'Trips': int(row['persona_trips'])} for _, row in top_concentration_stations.iterrows()}
-            coord_lookup = full_df.dropna(subset=['start_lat', 'start_lon']).set_index('start_station_name')[['start_lat', 'start_lon']].drop_duplicates()
             stations_with_coords = {}
             for _, row in top_concentration_stations.iterrows():
                 station = row['station']
-                if station in coord_lookup.index:
-                    coords = coord_lookup.loc[station]
-                    stations_with_coords[station] = {'lat': coords['start_lat'], 'lon': coords['start_lon'], 'concentration': row['relative_concentration'], 'persona_pct': row['concentration_pct']}
+                if station in ctx.start_coords:
+                    lat, lon = ctx.start_coords[station]
+                    stations_with_coords[station] = {'lat': lat, 'lon': lon, 'concentration': row['relative_concentration'], 'persona_pct': row['concentration_pct']}
             stats["opportunity_stations_with_coords"] = stations_with_coords
     else:
         stats["opportunity_stations"] = {}
@@ -114,17 +148,18 @@ def compute_marketing_stats(df: pd.DataFrame, persona: str) -> Dict[str, Any]:
     
     # --- Time and Duration Logic ---
     if "start_date" in df.columns:
-        start_datetime = pd.to_datetime(df["start_date"])
-        stats["trips_by_hour"] = start_datetime.dt.hour.value_counts().reindex(range(24), fill_value=0).sort_index().to_dict()
+        # Hour, weekday and month are small integers, so a bincount over each gives every bucket in one pass
+        start_datetime = df["start_date"].dropna().dt
+        hour_counts = np.bincount(start_datetime.hour.to_numpy(np.int8), minlength=24)
+        stats["trips_by_hour"] = dict(enumerate(hour_counts.tolist()))
         day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        stats["trips_by_day_of_week"] = start_datetime.dt.day_name().value_counts().reindex(day_order, fill_value=0).to_dict()
+        day_counts = np.bincount(start_datetime.weekday.to_numpy(np.int8), minlength=7)
+        stats["trips_by_day_of_week"] = dict(zip(day_order, day_counts.tolist()))
         
         # --- SEASONAL/MONTHLY ANALYSIS ---
-        # Calculate monthly usage patterns for seasonal analysis
-        monthly_counts = start_datetime.dt.month.value_counts().sort_index()
-        # Ensure all 12 months are represented (fill missing months with 0)
-        all_months = pd.Series(index=range(1, 13), data=0)
-        monthly_counts = monthly_counts.reindex(all_months.index, fill_value=0)
+        # Calculate monthly usage patterns for seasonal analysis; all 12 months are represented
+        month_counts = np.bincount(start_datetime.month.to_numpy(np.int8), minlength=13)[1:]
+        monthly_counts = pd.Series(month_counts, index=range(1, 13))
         
         # Convert to percentage for better visualization
         total_trips = len(df)
@@ -139,11 +174,28 @@ def compute_marketing_stats(df: pd.DataFrame, persona: str) -> Dict[str, Any]:
         stats["monthly_usage_counts"] = monthly_counts.to_dict()
         
     if "duration_minutes" in df.columns:
-        durations = df["duration_minutes"].dropna()
+        # Durations may be stored as float32; summarise in float64 and return plain floats so the
+        # rounded metrics display as e.g. 19.55 rather than the nearest float32
+        durations = df["duration_minutes"].dropna().astype('float64')
         if not durations.empty:
-            stats["trip_duration_mean_min"] = round(durations.mean(), 2)
-            stats["trip_duration_median_min"] = round(durations.median(), 2)
-            stats["trip_duration_25th_min"] = round(durations.quantile(0.25), 2)
-            stats["trip_duration_75th_min"] = round(durations.quantile(0.75), 2)
+            stats["trip_duration_mean_min"] = float(round(durations.mean(), 2))
+            stats["trip_duration_median_min"] = float(round(durations.median(), 2))
+            stats["trip_duration_25th_min"] = float(round(durations.quantile(0.25), 2))
+            stats["trip_duration_75th_min"] = float(round(durations.quantile(0.75), 2))
 
-    return stats
\ No newline at end of file
+    return stats
+
+def compute_all_marketing_stats(df: pd.DataFrame, ctx: Optional[MarketingContext] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Compute marketing statistics for "ALL" and for every persona in df in one go.
+    The MarketingContext and the persona row positions are built once and shared,
+    so each persona's stats only scan that persona's own rows.
+    Returns a {persona: stats} dict in the format of compute_marketing_stats.
+    """
+    if ctx is None:
+        ctx = MarketingContext(df)
+    all_stats = {"ALL": compute_marketing_stats(ctx.df, "ALL", ctx=ctx)}
+    if "persona" in ctx.df.columns:
+        for persona, rows in ctx.df.groupby("persona", observed=True, sort=False).indices.items():
+            all_stats[persona] = compute_marketing_stats(ctx.df, persona, rows, ctx)
+    return all_stats
@@ -1,35 +1,181 @@
-import os
+import functools
+import json
 import pandas as pd
 import numpy as np
-import plotly.express as px
 import plotly.graph_objects as go
+from plotly.colors import sample_colorscale
 import folium
-from folium.plugins import AntPath
+from folium.plugins import AntPath, FastMarkerCluster, HeatMap, MarkerCluster
+from branca.element import MacroElement
+from jinja2 import Template
 
-def _get_top_20_percent_threshold(station_data, count_key='count'):
+# Upper bound on persona footprint dots drawn on the prescriptive map
+MAX_FOOTPRINT_MARKERS = 5000
+
+# Layers with at least this many points are clustered; clusters break apart from CLUSTER_MAX_ZOOM on
+CLUSTER_MIN_POINTS = 50
+CLUSTER_MAX_ZOOM = 15
+
+# Footprint stations within one grid cell of this size (degrees, roughly 50 m) are drawn as a single dot
+FOOTPRINT_GRID_DEG = 0.0005
+FOOTPRINT_RADIUS = 3
+
+# Draws one persona footprint dot from a [lat, lon, tooltip, radius] row inside FastMarkerCluster
+_FOOTPRINT_CALLBACK = """function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {radius: row[3], color: '#3186cc', fill: true, fillColor: '#3186cc', fillOpacity: 0.7});
+    marker.bindTooltip(row[2]);
+    return marker;
+}"""
+
+# Hour axis of the temporal chart, labelled every two hours
+_HOURS_24 = tuple(range(24))
+_TICK_VALS = tuple(range(0, 24, 2))
+_TICK_TEXT = tuple(f"{h:02d}:00" for h in _TICK_VALS)
+
+# Fields a station dict may carry its usage count in, in order of preference
+_COUNT_KEYS = ('count', 'usage', 'usage_count')
+
+# Popup and tooltip templates for the prescriptive map pins, filled with str.format
+_START_POPUP = '<div style="font-family: Arial, sans-serif; font-size: 14px;"><h4 style="margin:0 0 5px 0; color:#2ECC71;">🟢 Top Start Station</h4><b>Station:</b> {name}<br><b>Total Starts:</b> {count}</div>'
+_END_POPUP = '<div style="font-family: Arial, sans-serif; font-size: 14px;"><h4 style="margin:0 0 5px 0; color:#E74C3C;">🔴 Top End Station</h4><b>Station:</b> {name}<br><b>Total Ends:</b> {count}</div>'
+_CORRIDOR_POPUP = '<div style="font-family: Arial, sans-serif; font-size: 14px;"><h4 style="margin:0 0 5px 0; color:#FF5733;">➡️ Popular Corridor</h4><b>Route:</b> {route_name}<br><b>Total Trips:</b> {count}</div>'
+_ROUND_TRIP_POPUP = '<div style="font-family: Arial, sans-serif; font-size: 14px;"><h4 style="margin:0 0 5px 0; color:#8E44AD;">🔄 Round Trip Hotspot</h4><b>Station:</b> {name}<br><b>Round Trips:</b> {count}</div>'
+_START_TOOLTIP = "Top Start: {name} ({count} trips)"
+_END_TOOLTIP = "Top End: {name} ({count} trips)"
+_ROUND_TRIP_TOOLTIP = "Round Trip Hotspot: {name}"
+
+# Popup and tooltip templates for each pin type
+_PIN_TEMPLATES = {
+    'start': (_START_POPUP, _START_TOOLTIP),
+    'end': (_END_POPUP, _END_TOOLTIP),
+    'round_trip': (_ROUND_TRIP_POPUP, _ROUND_TRIP_TOOLTIP),
+}
+
+# Columns of the frame the pins are emitted from
+_PIN_COLUMNS = ['lat', 'lon', 'name', 'count']
+
+# Icon styles of the prescriptive map pins
+_ICON_STYLES = {
+    'start': dict(color='green', icon='arrow-up', prefix='fa'),
+    'end': dict(color='red', icon='flag-checkered', prefix='fa'),
+    'round_trip': dict(color='purple', icon='refresh', prefix='fa'),
+}
+
+def _marker_layer(name, n_points, show=True):
+    """A MarkerCluster for layers with many points, otherwise a plain FeatureGroup."""
+    if n_points >= CLUSTER_MIN_POINTS:
+        return MarkerCluster(name=name, show=show, disableClusteringAtZoom=CLUSTER_MAX_ZOOM)
+    return folium.FeatureGroup(name=name, show=show)
+
+class _PrescriptiveLegend(MacroElement):
+    """Static legend of the prescriptive map; the template is compiled once at import."""
+    _template = Template("""
+    {% macro html(this, kwargs) %}
+    <div style="position: fixed; bottom: 20px; right: 20px; width: 290px; 
+                background-color: rgba(255, 255, 255, 0.95); border: 2px solid #bbb;
+                z-index:9999; font-size:14px; padding: 15px; border-radius: 8px;
+                color: #333; font-family: Arial, sans-serif; box-shadow: 3px 3px 10px rgba(0,0,0,0.2);">
+    <h4 style="margin-top:0; margin-bottom:10px; text-align:center; border-bottom: 1px solid #ccc; padding-bottom: 5px;">Map Legend</h4>
+    <p style="margin: 5px 0;"><i class="fa fa-arrow-up" style="color:green;"></i>   Top Start Station</p>
+    <p style="margin: 5px 0;"><i class="fa fa-flag-checkered" style="color:red;"></i>   Top End Station</p>
+    <p style="margin: 5px 0;"><i class="fa fa-long-arrow-right" style="color:#FF5733;"></i>   Popular Corridor (A → B)</p>
+    <p style="margin: 5px 0;"><i class="fa fa-refresh" style="color:#8E44AD;"></i>   Round Trip Hotspot</p>
+    <p style="margin: 5px 0;"><i class="fa fa-circle" style="color:#3186cc;"></i>   Persona Station Footprint (Top 20%)</p>
+    <p style="margin: 8px 0 0 0; font-size: 12px; font-style: italic; border-top: 1px solid #ddd; padding-top: 8px;">Animated lines show travel direction.</p>
+    </div>
+    {% endmacro %}
+    """)
+
+    def __init__(self):
+        super().__init__()
+        self._name = 'PrescriptiveLegend'
+
+class _LocationHeatmapLegend(MacroElement):
+    """Legend of the location heatmap, showing the top-20% usage threshold and, for markers, the colour tiers."""
+    _template = Template("""
+    {% macro html(this, kwargs) %}
+    <div style="position: fixed; bottom: 50px; left: 50px; width: 200px; height: 120px; 
+                background-color: white; border:2px solid grey; z-index:9999; 
+                font-size:14px; padding: 10px">
+    <p><b>Station Usage (Top 20%)</b></p>
+    {%- if this.show_tiers %}
+    <p><i class="fa fa-circle" style="color:#d62728"></i> High (>5%)</p>
+    <p><i class="fa fa-circle" style="color:#ff7f0e"></i> Medium (2-5%)</p>
+    <p><i class="fa fa-circle" style="color:#2ca02c"></i> Low (≥{{ "%.1f"|format(this.threshold) }}%)</p>
+    {%- endif %}
+    <p style="font-size: 11px; font-style: italic;">Threshold: {{ "%.1f"|format(this.threshold) }}%</p>
+    </div>
+    {% endmacro %}
+    """)
+
+    def __init__(self, threshold, show_tiers=True):
+        super().__init__()
+        self._name = 'LocationHeatmapLegend'
+        self.threshold = threshold
+        self.show_tiers = show_tiers
+
+def _station_values(station_data, key):
+    """Reads station[key] for every station into an array (0 where the key is missing)."""
+    return np.array([station.get(key, 0) for station in station_data])
+
+def _coord_array(coords):
+    """Stacks a Series of [lat, lon] lists into an (n, 2) float array, NaN where coordinates are missing."""
+    out = np.full((len(coords), 2), np.nan)
+    present = coords.notna().to_numpy()
+    if present.any():
+        out[present] = np.array(coords[present].tolist(), dtype=np.float64)
+    return out
+
+def _bucket_footprint(stations, counts):
     """
-    Helper function to calculate the threshold for top 20% of stations.
+    Merges footprint stations that fall in the same FOOTPRINT_GRID_DEG cell into one dot.
     
-    Args:
-        station_data: List of station dictionaries with usage counts
-        count_key: Key name for the count field (default: 'count')
-    
-    Returns:
-        float: The threshold value - stations with counts >= this value are in top 20%
+    Returns [lat, lon, tooltip, radius] rows in first-seen order. A merged dot sits at the
+    trip-weighted centre of its stations and its radius grows with the square root of the
+    number of stations merged, so lone stations keep FOOTPRINT_RADIUS and their own tooltip.
     """
-    if not station_data:
-        return 0
+    if not stations:
+        return []
+    lat = np.array([s['lat'] for s in stations], dtype=np.float64)
+    lon = np.array([s['lon'] for s in stations], dtype=np.float64)
+    cells = np.column_stack((np.floor(lat / FOOTPRINT_GRID_DEG), np.floor(lon / FOOTPRINT_GRID_DEG)))
+    _, first, inverse = np.unique(cells, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
     
-    # Extract counts and sort in descending order
-    counts = [station.get(count_key, 0) for station in station_data]
-    counts.sort(reverse=True)
+    n_stations = np.bincount(inverse)
+    trips = np.bincount(inverse, weights=counts)
+    # Weight by trips, falling back to a plain mean for cells whose stations have no trips
+    weights = np.where(trips[inverse] > 0, counts, 1.0)
+    total = np.bincount(inverse, weights=weights)
+    centre_lat = np.bincount(inverse, weights=lat * weights) / total
+    centre_lon = np.bincount(inverse, weights=lon * weights) / total
     
-    # Calculate the index for top 20%
-    # Ensure index is at least 0 and within bounds
+    footprint = []
+    for b in np.argsort(first):
+        if n_stations[b] == 1:
+            i = first[b]
+            footprint.append([stations[i]['lat'], stations[i]['lon'], f"Station: {stations[i].get('name', 'Unknown')} ({counts[i]} trips)", FOOTPRINT_RADIUS])
+        else:
+            footprint.append([float(centre_lat[b]), float(centre_lon[b]), f"{n_stations[b]} stations ({int(trips[b])} trips)",
+                              round(FOOTPRINT_RADIUS * float(np.sqrt(n_stations[b])), 1)])
+    return footprint
+
+def _resolve_count_key(station):
+    """Name of the usage count field in a station dict, checked in _COUNT_KEYS order."""
+    return next((key for key in _COUNT_KEYS if key in station), _COUNT_KEYS[-1])
+
+def _top_20_percent_threshold(counts):
+    """
+    Returns the minimum count a station needs to be in the top 20% of a non-empty array
+    of counts; stations with counts >= this value are in the top 20%.
+    """
+    # Rank of the top-20% cutoff counted from the largest value, kept within bounds
     top_20_index = min(len(counts) - 1, int(len(counts) * 0.2))
     
-    # Return the threshold value (minimum count to be in top 20%)
-    return counts[top_20_index] if top_20_index >= 0 else 0
+    # Select that rank with an O(n) partition instead of fully sorting
+    # (the threshold value is the minimum count to be in top 20%)
+    kth = len(counts) - 1 - top_20_index
+    return np.partition(counts, kth)[kth]
 
 def create_prescriptive_map(corridors_data, top_start_stations_data=None, top_end_stations_data=None, persona_stations_data=None):
     """
@@ -40,168 +186,234 @@ def create_prescriptive_map(corridors_data, top_start_stations_data=None, top_en
     - Shows Round Trip Hotspots (purple pins).
     """
     london_center = [51.5074, -0.1278]
-    m = folium.Map(location=london_center, zoom_start=12, tiles='CartoDB positron')
+    # Canvas draws all the dots in one pass instead of creating an SVG element per marker
+    m = folium.Map(location=london_center, zoom_start=12, tiles='CartoDB positron', prefer_canvas=True)
 
+    # One icon per pin type, shared by all markers of that type on this map
+    icons = {kind: folium.Icon(**style) for kind, style in _ICON_STYLES.items()}
+    
     # --- Layer Groups ---
-    start_pin_group = folium.FeatureGroup(name='🟢 Top Start Stations', show=True).add_to(m)
-    end_pin_group = folium.FeatureGroup(name='🔴 Top End Stations', show=True).add_to(m)
+    start_pin_group = _marker_layer('🟢 Top Start Stations', len(top_start_stations_data or [])).add_to(m)
+    end_pin_group = _marker_layer('🔴 Top End Stations', len(top_end_stations_data or [])).add_to(m)
     corridor_group = folium.FeatureGroup(name='➡️ Popular Corridors (A → B)', show=True).add_to(m)
-    round_trip_group = folium.FeatureGroup(name='🔄 Round Trip Hotspots', show=True).add_to(m)
+    round_trip_group = _marker_layer('🔄 Round Trip Hotspots', len(corridors_data or [])).add_to(m)
     
     # --- Layer: Persona Station Footprint (Top 20% Blue Dots) ---
     if persona_stations_data:
         # Determine the count key based on available data structure
-        sample_station = persona_stations_data[0] if persona_stations_data else {}
-        count_key = 'count' if 'count' in sample_station else 'usage' if 'usage' in sample_station else 'usage_count'
+        count_key = _resolve_count_key(persona_stations_data[0])
+        counts = _station_values(persona_stations_data, count_key)
+        top_20_threshold = _top_20_percent_threshold(counts)
         
-        top_20_threshold = _get_top_20_percent_threshold(persona_stations_data, count_key)
+        # Only show stations in the top 20% of usage for this persona
+        keep_idx = np.flatnonzero(counts >= top_20_threshold)
+        if len(keep_idx) > MAX_FOOTPRINT_MARKERS:
+            # Too many dots to be readable; keep the busiest ones in their original order
+            keep_idx = np.sort(keep_idx[np.argsort(-counts[keep_idx], kind='stable')[:MAX_FOOTPRINT_MARKERS]])
+        keep_idx = [i for i in keep_idx if 'lat' in persona_stations_data[i] and 'lon' in persona_stations_data[i]]
+        footprint = _bucket_footprint([persona_stations_data[i] for i in keep_idx], counts[keep_idx])
         
-        persona_footprint_group = folium.FeatureGroup(name='🔵 Persona Station Footprint (Top 20%)', show=True).add_to(m)
-        for station in persona_stations_data:
-            # Only show stations in the top 20% of usage for this persona
-            station_count = station.get(count_key, 0)
-            if 'lat' in station and 'lon' in station and station_count >= top_20_threshold:
+        footprint_name = '🔵 Persona Station Footprint (Top 20%)'
+        if len(footprint) >= CLUSTER_MIN_POINTS:
+            # Large footprints are handed to the browser as one array and clustered there
+            FastMarkerCluster(footprint, callback=_FOOTPRINT_CALLBACK, name=footprint_name, show=True,
+                              disableClusteringAtZoom=CLUSTER_MAX_ZOOM).add_to(m)
+        else:
+            persona_footprint_group = folium.FeatureGroup(name=footprint_name, show=True).add_to(m)
+            for lat, lon, tooltip, radius in footprint:
                 folium.CircleMarker(
-                    location=[station['lat'], station['lon']],
-                    radius=3, color='#3186cc', fill=True, fill_color='#3186cc', fill_opacity=0.7,
-                    tooltip=f"Station: {station.get('name', 'Unknown')} ({station_count} trips)"
+                    location=[lat, lon],
+                    radius=radius, color='#3186cc', fill=True, fill_color='#3186cc', fill_opacity=0.7,
+                    tooltip=tooltip
                 ).add_to(persona_footprint_group)
 
-    # --- Layer: Top Start/End Station Pins ---
-    if top_start_stations_data:
-        for station in top_start_stations_data:
-            popup_html = f"""<div style="font-family: Arial, sans-serif; font-size: 14px;"><h4 style="margin:0 0 5px 0; color:#2ECC71;">🟢 Top Start Station</h4><b>Station:</b> {station['name']}<br><b>Total Starts:</b> {station['count']}</div>"""
-            folium.Marker(location=[station['lat'], station['lon']], popup=folium.Popup(popup_html, max_width=300), tooltip=f"Top Start: {station['name']} ({station['count']} trips)", icon=folium.Icon(color='green', icon='arrow-up', prefix='fa')).add_to(start_pin_group)
-            
-    if top_end_stations_data:
-        for station in top_end_stations_data:
-            popup_html = f"""<div style="font-family: Arial, sans-serif; font-size: 14px;"><h4 style="margin:0 0 5px 0; color:#E74C3C;">🔴 Top End Station</h4><b>Station:</b> {station['name']}<br><b>Total Ends:</b> {station['count']}</div>"""
-            folium.Marker(location=[station['lat'], station['lon']], popup=folium.Popup(popup_html, max_width=300), tooltip=f"Top End: {station['name']} ({station['count']} trips)", icon=folium.Icon(color='red', icon='flag-checkered', prefix='fa')).add_to(end_pin_group)
-            
     # --- Layer: Corridors and Round Trips ---
+    round_trips = None
     if corridors_data:
-        round_trip_stations = {}
-        for route in corridors_data:
-            is_round_trip = route.get('start_coords') == route.get('end_coords')
-            if is_round_trip and 'start_coords' in route:
-                station_name = route['route_name'].split(' → ')[0]
-                coords = tuple(route['start_coords'])
-                if coords not in round_trip_stations:
-                    round_trip_stations[coords] = {'name': station_name, 'count': route['count']}
-                else:
-                    round_trip_stations[coords]['count'] += route['count']
-            elif 'start_coords' in route and 'end_coords' in route:
-                popup_html = f"""<div style="font-family: Arial, sans-serif; font-size: 14px;"><h4 style="margin:0 0 5px 0; color:#FF5733;">➡️ Popular Corridor</h4><b>Route:</b> {route['route_name']}<br><b>Total Trips:</b> {route['count']}</div>"""
+        routes = pd.DataFrame(corridors_data)
+        if 'start_coords' in routes.columns and 'end_coords' in routes.columns:
+            # Unpack the coordinate lists into float columns once, then classify every route at once:
+            # the same start and end coordinates make a round trip
+            start = _coord_array(routes['start_coords'])
+            end = _coord_array(routes['end_coords'])
+            has_coords = pd.Series(~np.isnan(start).any(axis=1) & ~np.isnan(end).any(axis=1), index=routes.index)
+            is_round_trip = has_coords & (start == end).all(axis=1)
+            routes = routes.assign(start_lat=start[:, 0], start_lon=start[:, 1])
+            
+            corridors = routes.loc[has_coords & ~is_round_trip, ['route_name', 'count', 'start_coords', 'end_coords']]
+            for route_name, count, start_coords, end_coords in corridors.itertuples(index=False, name=None):
                 AntPath(
-                    locations=[route['start_coords'], route['end_coords']],
+                    locations=[start_coords, end_coords],
                     weight=5, color='#FF5733', delay=800, dash_array=[10, 20],
-                    popup=folium.Popup(popup_html, max_width=300)
+                    popup=folium.Popup(_CORRIDOR_POPUP.format(route_name=route_name, count=count), max_width=300)
                 ).add_to(corridor_group)
-
-        for coords, data in round_trip_stations.items():
-            popup_html = f"""<div style="font-family: Arial, sans-serif; font-size: 14px;"><h4 style="margin:0 0 5px 0; color:#8E44AD;">🔄 Round Trip Hotspot</h4><b>Station:</b> {data['name']}<br><b>Round Trips:</b> {data['count']}</div>"""
-            folium.Marker(location=list(coords), popup=folium.Popup(popup_html, max_width=300), tooltip=f"Round Trip Hotspot: {data['name']}", icon=folium.Icon(color='purple', icon='refresh', prefix='fa')).add_to(round_trip_group)
+            
+            # Sum round trips per station in one groupby keyed on the float coordinate columns;
+            # the first route seen at a station names it
+            round_trips = routes.loc[is_round_trip].groupby(['start_lat', 'start_lon'], sort=False).agg(
+                route_name=('route_name', 'first'), count=('count', 'sum')
+            )
+            round_trips = round_trips.assign(name=round_trips['route_name'].str.split(' → ', n=1).str[0])
+            round_trips = round_trips.reset_index().rename(columns={'start_lat': 'lat', 'start_lon': 'lon'})
+            
+    # --- Layer: Start, End and Round Trip Pins ---
+    # All pin types share one frame and one loop; the kind column picks the layer, icon and templates
+    pins = {
+        'start': pd.DataFrame(top_start_stations_data or [], columns=_PIN_COLUMNS),
+        'end': pd.DataFrame(top_end_stations_data or [], columns=_PIN_COLUMNS),
+        'round_trip': round_trips[_PIN_COLUMNS] if round_trips is not None else None,
+    }
+    pins = {kind: frame for kind, frame in pins.items() if frame is not None and len(frame)}
+    if pins:
+        dispatch = {
+            'start': (start_pin_group, icons['start']),
+            'end': (end_pin_group, icons['end']),
+            'round_trip': (round_trip_group, icons['round_trip']),
+        }
+        pins = pd.concat(pins, names=['kind']).reset_index(level='kind')
+        for kind, lat, lon, name, count in pins[['kind'] + _PIN_COLUMNS].itertuples(index=False, name=None):
+            group, icon = dispatch[kind]
+            popup, tooltip = _PIN_TEMPLATES[kind]
+            data = {'name': name, 'count': count}
+            folium.Marker(location=[lat, lon], popup=folium.Popup(popup.format(**data), max_width=300), tooltip=tooltip.format(**data), icon=icon).add_to(group)
             
     # --- Custom Legend ---
-    legend_html = '''
-    <div style="position: fixed; bottom: 20px; right: 20px; width: 290px; 
-                background-color: rgba(255, 255, 255, 0.95); border: 2px solid #bbb;
-                z-index:9999; font-size:14px; padding: 15px; border-radius: 8px;
-                color: #333; font-family: Arial, sans-serif; box-shadow: 3px 3px 10px rgba(0,0,0,0.2);">
-    <h4 style="margin-top:0; margin-bottom:10px; text-align:center; border-bottom: 1px solid #ccc; padding-bottom: 5px;">Map Legend</h4>
-    <p style="margin: 5px 0;"><i class="fa fa-arrow-up" style="color:green;"></i>   Top Start Station</p>
-    <p style="margin: 5px 0;"><i class="fa fa-flag-checkered" style="color:red;"></i>   Top End Station</p>
-    <p style="margin: 5px 0;"><i class="fa fa-long-arrow-right" style="color:#FF5733;"></i>   Popular Corridor (A → B)</p>
-    <p style="margin: 5px 0;"><i class="fa fa-refresh" style="color:#8E44AD;"></i>   Round Trip Hotspot</p>
-    <p style="margin: 5px 0;"><i class="fa fa-circle" style="color:#3186cc;"></i>   Persona Station Footprint (Top 20%)</p>
-    <p style="margin: 8px 0 0 0; font-size: 12px; font-style: italic; border-top: 1px solid #ddd; padding-top: 8px;">Animated lines show travel direction.</p>
-    </div>
-    '''
-    m.get_root().html.add_child(folium.Element(legend_html))
+    m.get_root().add_child(_PrescriptiveLegend())
 
     folium.LayerControl().add_to(m)
     return m
 
+def render_prescriptive_map_html(corridors_data, top_start_stations_data=None, top_end_stations_data=None, persona_stations_data=None):
+    """
+    Returns the full HTML page of create_prescriptive_map for the given inputs.
+    Renders are memoized on the inputs, so showing the same persona again skips
+    building and templating the map; embed the result with st.components.v1.html.
+    """
+    inputs = json.dumps([corridors_data, top_start_stations_data, top_end_stations_data, persona_stations_data], default=_json_default)
+    return _render_prescriptive_map_html(inputs)
+
+def _json_default(value):
+    """Converts NumPy scalars in map inputs to plain Python numbers for JSON."""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+@functools.lru_cache(maxsize=16)
+def _render_prescriptive_map_html(inputs):
+    # The JSON-encoded inputs are both the cache key and the data the map is built from
+    return create_prescriptive_map(*json.loads(inputs)).get_root().render()
+
 def create_temporal_chart(hourly_distribution):
-    """Create temporal activity chart showing hourly patterns"""
-    hours = list(range(24))
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=hours, y=hourly_distribution, mode='lines+markers', name='Activity Level',
+    """Create temporal activity chart showing hourly patterns (memoized; treat the figure as read-only)"""
+    return _temporal_chart(tuple(hourly_distribution))
+
+@functools.lru_cache(maxsize=32)
+def _temporal_chart(hourly_distribution):
+    # Data and layout go into one constructor call so the figure is validated once
+    trace = go.Scatter(
+        x=_HOURS_24, y=hourly_distribution, mode='lines+markers', name='Activity Level',
         line=dict(color='#1f77b4', width=3), marker=dict(size=8, color='#1f77b4')
-    ))
-    fig.update_layout(
+    )
+    layout = go.Layout(
         title="Daily Activity Pattern", xaxis_title="Hour of Day", yaxis_title="Number of Trips",
         template="plotly_white", height=400, showlegend=False,
-        xaxis=dict(tickmode='array', tickvals=list(range(0, 24, 2)), ticktext=[f"{h:02d}:00" for h in range(0, 24, 2)])
+        xaxis=dict(tickmode='array', tickvals=_TICK_VALS, ticktext=_TICK_TEXT),
+        # Rush-hour bands, laid out directly rather than through add_vrect
+        shapes=[
+            dict(type='rect', xref='x', x0=7, x1=9, yref='y domain', y0=0, y1=1, fillcolor="#ff7f0e", opacity=0.2),
+            dict(type='rect', xref='x', x0=17, x1=19, yref='y domain', y0=0, y1=1, fillcolor="#ff7f0e", opacity=0.2),
+        ],
+        annotations=[
+            dict(text="Morning Rush", showarrow=False, xref='x', x=7, xanchor='left', yref='y domain', y=1, yanchor='top'),
+            dict(text="Evening Rush", showarrow=False, xref='x', x=19, xanchor='right', yref='y domain', y=1, yanchor='top'),
+        ]
     )
-    fig.add_vrect(x0=7, x1=9, fillcolor="#ff7f0e", opacity=0.2, annotation_text="Morning Rush", annotation_position="top left")
-    fig.add_vrect(x0=17, x1=19, fillcolor="#ff7f0e", opacity=0.2, annotation_text="Evening Rush", annotation_position="top right")
-    return fig
+    return go.Figure(data=[trace], layout=layout)
 
-def create_location_heatmap(station_data):
-    """Create interactive map with station usage heatmap - showing only top 20% of stations"""
+def create_location_heatmap(station_data, mode='heat'):
+    """
+    Create interactive map with station usage heatmap - showing only top 20% of stations.
+    mode='heat' draws a Leaflet.heat layer weighted by usage percentage on one canvas;
+    mode='markers' draws one colour-tiered circle per station with a popup, for small station lists.
+    """
+    if mode not in ('heat', 'markers'):
+        raise ValueError(f"Unknown heatmap mode: {mode}")
     london_center = [51.5074, -0.1278]
-    m = folium.Map(location=london_center, zoom_start=12, tiles='OpenStreetMap')
+    m = folium.Map(location=london_center, zoom_start=12, tiles='OpenStreetMap', prefer_canvas=True)
     
     if not station_data:
         return m
     
     # Calculate top 20% threshold based on usage percentage
-    top_20_threshold = _get_top_20_percent_threshold(station_data, 'percentage')
+    percentages = np.fromiter((station['percentage'] for station in station_data), dtype=np.float64, count=len(station_data))
+    top_20_threshold = _top_20_percent_threshold(percentages)
     
-    for station in station_data:
-        # Only show stations in top 20%
-        if station['percentage'] >= top_20_threshold:
-            if station['percentage'] > 5:
-                color, radius = '#d62728', 12
-            elif station['percentage'] > 2:
-                color, radius = '#ff7f0e', 8
-            else:
-                color, radius = '#2ca02c', 6
+    # Only show stations in top 20%
+    keep_idx = np.flatnonzero(percentages >= top_20_threshold)
+    
+    if mode == 'heat':
+        # Leaflet.heat saturates at a weight of 1, so scale by the busiest station
+        max_pct = percentages[keep_idx].max() or 1.0
+        data = [[station_data[i]['lat'], station_data[i]['lon'], percentages[i] / max_pct] for i in keep_idx]
+        HeatMap(data, name='Station Usage', min_opacity=0.3, radius=15, blur=20).add_to(m)
+    else:
+        # Usage tier per station: low (<=2%), medium (2-5%) or high (>5%)
+        tiers = np.digitize(percentages, [2, 5], right=True)
+        tier_colors = ('#2ca02c', '#ff7f0e', '#d62728')
+        tier_radii = (6, 8, 12)
+        
+        marker_group = _marker_layer('Station Usage', len(keep_idx)).add_to(m)
+        for i in keep_idx:
+            station = station_data[i]
+            color, radius = tier_colors[tiers[i]], tier_radii[tiers[i]]
             folium.CircleMarker(
                 location=[station['lat'], station['lon']], radius=radius,
                 popup=f"<b>{station['name']}</b><br>Usage: {station['usage']} trips<br>Percentage: {station['percentage']:.1f}%",
                 color=color, fillColor=color, fillOpacity=0.7, weight=2
-            ).add_to(m)
+            ).add_to(marker_group)
     
-    legend_html = f'''
-    <div style="position: fixed; bottom: 50px; left: 50px; width: 200px; height: 120px; 
-                background-color: white; border:2px solid grey; z-index:9999; 
-                font-size:14px; padding: 10px">
-    <p><b>Station Usage (Top 20%)</b></p>
-    <p><i class="fa fa-circle" style="color:#d62728"></i> High (>5%)</p>
-    <p><i class="fa fa-circle" style="color:#ff7f0e"></i> Medium (2-5%)</p>
-    <p><i class="fa fa-circle" style="color:#2ca02c"></i> Low (≥{top_20_threshold:.1f}%)</p>
-    <p style="font-size: 11px; font-style: italic;">Threshold: {top_20_threshold:.1f}%</p>
-    </div>
-    '''
-    m.get_root().html.add_child(folium.Element(legend_html))
+    m.get_root().add_child(_LocationHeatmapLegend(top_20_threshold, show_tiers=mode == 'markers'))
     return m
 
 def create_duration_distribution_chart(durations, persona_name):
     """Create trip duration distribution chart"""
-    if not durations or len(durations) == 0:
-        return go.Figure().update_layout(title=f"No duration data for {persona_name}")
-    fig = px.histogram(x=durations, nbins=30, title=f"Trip Duration Distribution - {persona_name}", color_discrete_sequence=['#1f77b4'])
-    fig.update_layout(xaxis_title="Duration (minutes)", yaxis_title="Number of Trips", template="plotly_white", height=400)
-    mean_duration = np.mean(durations)
-    fig.add_vline(x=mean_duration, line_dash="dash", line_color="#d62728", annotation_text=f"Average: {mean_duration:.1f} min")
-    return fig
+    durations = np.asarray(durations if durations is not None else [], dtype=np.float64)
+    if durations.size == 0:
+        return go.Figure(layout=go.Layout(title=f"No duration data for {persona_name}"))
+    # Bin in NumPy so only the 30 bar heights are sent to the browser, not every trip
+    counts, edges = np.histogram(durations, bins=30)
+    trace = go.Bar(x=0.5 * (edges[:-1] + edges[1:]), y=counts, width=np.diff(edges), marker_color='#1f77b4')
+    mean_duration = durations.mean()
+    layout = go.Layout(
+        title=f"Trip Duration Distribution - {persona_name}", xaxis_title="Duration (minutes)", yaxis_title="Number of Trips", template="plotly_white", height=400, bargap=0,
+        # Average marker, laid out directly rather than through add_vline
+        shapes=[dict(type='line', xref='x', x0=mean_duration, x1=mean_duration, yref='y domain', y0=0, y1=1, line=dict(color="#d62728", dash="dash"))],
+        annotations=[dict(text=f"Average: {mean_duration:.1f} min", showarrow=False, xref='x', x=mean_duration, xanchor='left', yref='y domain', y=1, yanchor='top')]
+    )
+    return go.Figure(data=[trace], layout=layout)
 
 def create_seasonal_trends_chart(monthly_data):
-    """Create seasonal trends visualization"""
+    """Create seasonal trends visualization (memoized; treat the figure as read-only)"""
+    return _seasonal_trends_chart(tuple(monthly_data))
+
+@functools.lru_cache(maxsize=32)
+def _seasonal_trends_chart(monthly_data):
     months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(x=months, y=monthly_data, mode='lines+markers', name='Usage %', line=dict(color='#2ca02c', width=3), marker=dict(size=8, color='#2ca02c'), fill='tonexty'))
-    fig.update_layout(title="Seasonal Usage Patterns", xaxis_title="Month", yaxis_title="Usage Percentage", template="plotly_white", height=400, showlegend=False)
-    return fig
+    trace = go.Scatter(x=months, y=monthly_data, mode='lines+markers', name='Usage %', line=dict(color='#2ca02c', width=3), marker=dict(size=8, color='#2ca02c'), fill='tonexty')
+    layout = go.Layout(title="Seasonal Usage Patterns", xaxis_title="Month", yaxis_title="Usage Percentage", template="plotly_white", height=400, showlegend=False)
+    return go.Figure(data=[trace], layout=layout)
 
 def create_day_of_week_chart(dow_data):
-    """Create day of week usage chart"""
+    """Create day of week usage chart (memoized; treat the figure as read-only)"""
+    return _day_of_week_chart(tuple(dow_data.values()) if isinstance(dow_data, dict) else tuple(dow_data))
+
+@functools.lru_cache(maxsize=32)
+def _day_of_week_chart(y_values):
     days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    y_values = list(dow_data.values()) if isinstance(dow_data, dict) else dow_data
-    fig = px.bar(x=days, y=y_values, title="Usage by Day of Week", color=y_values, color_continuous_scale='Viridis')
-    fig.update_layout(xaxis_title="Day of Week", yaxis_title="Number of Trips", template="plotly_white", height=400)
-    fig.update(layout_coloraxis_showscale=False)
-    return fig
\ No newline at end of file
+    y = np.asarray(y_values, dtype=float)
+    # Colour each bar along Viridis by its value, as a continuous colour axis would
+    span = y.max() - y.min() if y.size else 0
+    colors = sample_colorscale('Viridis', (y - y.min()) / span if span else np.zeros_like(y))
+    trace = go.Bar(x=days, y=list(y_values), marker_color=colors)
+    layout = go.Layout(title="Usage by Day of Week", xaxis_title="Day of Week", yaxis_title="Number of Trips", template="plotly_white", height=400)
+    return go.Figure(data=[trace], layout=layout)
\ No newline at end of file